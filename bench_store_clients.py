@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one-off connections vs a pooled keep-alive client for HTTP store
+adapters, against a local stub store server
+"""
+
+import asyncio
+import time
+
+from shopping_mcp_server import CATALOG
+from stores import HttpStoreAdapter
+from stub_store import start_stub_store
+
+REQUESTS = 300
+CONCURRENCY = 10
+
+
+async def run(adapter: HttpStoreAdapter, product) -> float:
+    """Seconds taken by REQUESTS offer lookups, CONCURRENCY at a time"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def lookup():
+        async with semaphore:
+            await adapter.get_offer(product)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(lookup() for _ in range(REQUESTS)))
+    return time.perf_counter() - start
+
+
+async def main():
+    """Run the benchmark"""
+    stub, base_url = start_stub_store()
+    store_info = {"name": "Stub", "api_url": f"{base_url}/fast"}
+    product = CATALOG.products[0]
+
+    try:
+        adapter = HttpStoreAdapter("stub", store_info)
+        one_off = await run(adapter, product)
+
+        await adapter.open()
+        try:
+            pooled = await run(adapter, product)
+        finally:
+            await adapter.close()
+    finally:
+        stub.shutdown()
+
+    print(f"{REQUESTS} offer lookups, {CONCURRENCY} concurrent:")
+    print(f"  One connection per lookup: {one_off:.3f}s ({one_off / REQUESTS * 1000:.2f} ms/lookup)")
+    print(f"  Pooled keep-alive client:  {pooled:.3f}s ({pooled / REQUESTS * 1000:.2f} ms/lookup)")
+    print(f"  Speedup: {one_off / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
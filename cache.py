@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Result caches for MCP tool calls: an in-process LRU tier and a persistent
+SQLite tier shared by server processes and restarts
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import orjson
+
+# Seconds a disk cache operation waits for another process's write lock
+DISK_BUSY_TIMEOUT_SECONDS = 5.0
+
+# Disk cache writes between two size checks
+DISK_EVICTION_INTERVAL = 64
+
+# Share of max_bytes kept when the disk cache is over its size limit
+DISK_EVICTION_TARGET = 0.8
+
+
+def normalize_arguments(arguments: Optional[Dict[str, Any]], defaults: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Canonical JSON form of tool arguments: keys sorted, unset values and
+    values equal to their defaults dropped
+    """
+    defaults = defaults or {}
+    normalized = {
+        key: value for key, value in (arguments or {}).items()
+        if value is not None and not (key in defaults and defaults[key] == value)
+    }
+    return json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache with a per-tool TTL. Entries remember the catalog
+    version they were computed for and are treated as misses once it changes.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl or {}
+        self.default_ttl = default_ttl
+        self.entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, tool: str, arguments: Optional[Dict[str, Any]],
+            defaults: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """Cache key for a tool call"""
+        return tool, normalize_arguments(arguments, defaults)
+
+    def get(self, key: Tuple[str, str], version: Hashable) -> Optional[Any]:
+        """Cached value for key, or None on a miss"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, entry_version, value = entry
+            if entry_version == version and expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple[str, str], version: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Store value for key, evicting the least recently used entries. ttl
+        overrides the per-tool TTL.
+        """
+        if ttl is None:
+            ttl = self.ttl.get(key[0], self.default_ttl)
+        if ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, version, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every entry"""
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class DiskCache:
+    """
+    Persistent cache in a SQLite file. Values are stored as JSON with a
+    wall-clock expiry and the version they were computed for; entries of
+    another version are misses. Several processes can share the file: it
+    runs in WAL mode, so readers never block the single writer. Once the
+    file holds more than max_bytes of values, the least recently used
+    entries are evicted. Database errors degrade to cache misses.
+
+    Async code uses aget/aget_many and put_nowait/put_many_nowait, which run
+    the database calls on one dedicated thread, so a write lock held by
+    another process never stalls the event loop.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, ttl: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 300.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl or {}
+        self.default_ttl = default_ttl
+        self.connection: Optional[sqlite3.Connection] = None
+        # Runs the database calls of the async methods in submission order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def connect(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit: every statement is its own short transaction
+            connection = sqlite3.connect(self.path, timeout=DISK_BUSY_TIMEOUT_SECONDS,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, expires REAL NOT NULL, "
+                "accessed REAL NOT NULL, size INTEGER NOT NULL, value BLOB NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self.connection = connection
+        return self.connection
+
+    @staticmethod
+    def encode_key(key: Tuple[str, str]) -> str:
+        """Text form of a (tool, normalized arguments) key"""
+        return "\x1f".join(key)
+
+    def get(self, key: Tuple[str, str], version: str) -> Optional[Tuple[Any, float]]:
+        """Cached value for key and its remaining lifetime in seconds, or None on a miss"""
+        return self.get_many([key], version).get(key)
+
+    def get_many(self, keys: List[Tuple[str, str]], version: str) -> Dict[Tuple[str, str], Tuple[Any, float]]:
+        """Cached (value, remaining lifetime) of every key that is present and fresh"""
+        if not keys:
+            return {}
+        encoded = {self.encode_key(key): key for key in keys}
+        now = time.time()
+        found = {}
+        try:
+            connection = self.connect()
+            placeholders = ",".join("?" * len(encoded))
+            rows = connection.execute(
+                f"SELECT key, expires, value FROM entries WHERE key IN ({placeholders}) "
+                "AND version = ? AND expires > ?",
+                [*encoded, version, now]
+            ).fetchall()
+            for text_key, expires, value in rows:
+                found[encoded[text_key]] = (orjson.loads(value), expires - now)
+            if rows:
+                connection.execute(
+                    f"UPDATE entries SET accessed = ? WHERE key IN ({','.join('?' * len(rows))})",
+                    [now, *(row[0] for row in rows)]
+                )
+        except sqlite3.Error:
+            self.errors += 1
+            found = {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: Tuple[str, str], version: str, value: Any, ttl: Optional[float] = None):
+        """Store value for key; ttl overrides the per-tool TTL"""
+        self.put_many([(key, value)], version, ttl)
+
+    def put_many(self, items: Iterable[Tuple[Tuple[str, str], Any]], version: str, ttl: Optional[float] = None):
+        """Store (key, value) pairs in one transaction"""
+        now = time.time()
+        rows = []
+        for key, value in items:
+            entry_ttl = self.ttl.get(key[0], self.default_ttl) if ttl is None else ttl
+            if entry_ttl <= 0:
+                continue
+            blob = orjson.dumps(value)
+            rows.append((self.encode_key(key), version, now + entry_ttl, now, len(blob), blob))
+        if not rows:
+            return
+        try:
+            connection = self.connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, version, expires, accessed, size, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            previous, self.writes = self.writes, self.writes + len(rows)
+            if previous // DISK_EVICTION_INTERVAL != self.writes // DISK_EVICTION_INTERVAL:
+                self.evict()
+        except sqlite3.Error:
+            self.errors += 1
+
+    async def aget(self, key: Tuple[str, str], version: str) -> Optional[Tuple[Any, float]]:
+        """get() off the event loop"""
+        return (await self.aget_many([key], version)).get(key)
+
+    async def aget_many(self, keys: List[Tuple[str, str]], version: str
+                        ) -> Dict[Tuple[str, str], Tuple[Any, float]]:
+        """get_many() off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.get_many, keys, version)
+
+    def put_nowait(self, key: Tuple[str, str], version: str, value: Any, ttl: Optional[float] = None):
+        """Queue put() without waiting for it; later async reads see it"""
+        self.put_many_nowait([(key, value)], version, ttl)
+
+    def put_many_nowait(self, items: Iterable[Tuple[Tuple[str, str], Any]], version: str,
+                        ttl: Optional[float] = None):
+        """Queue put_many() without waiting for it; later async reads see it"""
+        self.executor.submit(self.put_many, list(items), version, ttl)
+
+    async def aclose(self):
+        """Wait for queued writes, then close the database connection"""
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.close)
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones over the size limit"""
+        connection = self.connect()
+        connection.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+        (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total > self.max_bytes:
+            cursor = connection.execute(
+                "DELETE FROM entries WHERE key IN ("
+                "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS kept FROM entries) "
+                "WHERE kept > ?)",
+                (self.max_bytes * DISK_EVICTION_TARGET,)
+            )
+            self.evictions += cursor.rowcount
+
+    def clear(self):
+        """Drop every entry"""
+        try:
+            self.connect().execute("DELETE FROM entries")
+        except sqlite3.Error:
+            self.errors += 1
+
+    def close(self):
+        """Close the database connection"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the
+    work and every caller arriving before it finishes awaits the same task.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of fn(), shared with concurrent callers using the same key"""
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one caller giving up does not cancel the others' work
+        return await asyncio.shield(task)
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+Compiled product catalog with search indexes built once at startup
+"""
+
+import heapq
+import json
+import mmap
+import os
+import pickle
+import re
+from itertools import islice
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from search_index import (
+    TOKEN_RE, BM25Index, PrefixTrie, SpellIndex, TokenIndex, TrigramIndex, find_key, intersect_sorted, key_array,
+    tokenize
+)
+from stores import stable_hash
+
+# Files of a catalog snapshot: the pickled products and small tables, and
+# every NumPy array, the compiled text indexes included, packed into one file
+# that processes memory-map read-only
+SNAPSHOT_INDEXES = "catalog.pkl"
+SNAPSHOT_ARRAYS = "catalog.bin"
+
+# Byte alignment of arrays in the snapshot array file
+SNAPSHOT_ALIGNMENT = 64
+
+# Query words shorter than this are never spell-corrected
+MIN_CORRECTION_LENGTH = 3
+
+# Relative weight of each product field in relevance ranking
+RANKING_FIELDS = {"name": 3.0, "brand": 2.0, "specs": 1.0}
+
+# Upper edges of the price facet buckets, in AED
+PRICE_BUCKET_EDGES = [100, 500, 1000, 2500, 5000]
+PRICE_BUCKET_LABELS = ["Under 100", "100-500", "500-1000", "1000-2500", "2500-5000", "5000+"]
+
+# Numeric spec attributes parsed at load: attribute -> (spec keys, unit multipliers)
+SPEC_ATTRIBUTES = {
+    "storage_gb": (("storage",), {"gb": 1, "tb": 1024}),
+    "ram_gb": (("ram",), {"gb": 1}),
+    "display_inch": (("display", "size"), {"inch": 1}),
+    "battery_mah": (("battery",), {"mah": 1}),
+    "weight_kg": (("weight",), {"kg": 1, "g": 0.001}),
+}
+
+# search_products spec filters: filter -> (attribute, bound)
+SPEC_FILTERS = {
+    "min_storage_gb": ("storage_gb", "min"),
+    "min_ram_gb": ("ram_gb", "min"),
+    "min_display_inch": ("display_inch", "min"),
+    "max_display_inch": ("display_inch", "max"),
+    "min_battery_mah": ("battery_mah", "min"),
+    "max_weight_kg": ("weight_kg", "max"),
+}
+
+# Completions kept per trie node for autocomplete and name resolution
+AUTOCOMPLETE_LIMIT = 10
+
+# Ids converted to Python ints at a time when lazily walking an id array
+ID_CHUNK = 256
+
+SPEC_VALUE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*([a-z]+)")
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase name with runs of whitespace collapsed"""
+    return " ".join(name.lower().split())
+
+
+def iter_ids(ids: Any) -> Iterator[int]:
+    """Ids of an array as Python ints, converted ID_CHUNK at a time, or of a range"""
+    if isinstance(ids, range):
+        yield from ids
+        return
+    for start in range(0, len(ids), ID_CHUNK):
+        yield from ids[start:start + ID_CHUNK].tolist()
+
+
+def parse_spec_value(value: Any, units: Dict[str, float]) -> Optional[float]:
+    """First number in a spec value followed by one of units, converted, or None"""
+    for number, unit in SPEC_VALUE_RE.findall(str(value).lower()):
+        if unit in units:
+            return float(number) * units[unit]
+    return None
+
+
+class Product:
+    """Compact product record; fields mirror the MOCK_PRODUCTS entries"""
+
+    __slots__ = ("id", "category", "name", "brand", "price", "currency", "rating", "in_stock", "specs")
+
+    def __init__(self, product_id: int, category: str, data: Dict[str, Any]):
+        self.id = product_id
+        self.category = category
+        self.name = data["name"]
+        self.brand = data.get("brand")
+        self.price = data["price"]
+        self.currency = data["currency"]
+        self.rating = data.get("rating")
+        self.in_stock = data.get("in_stock")
+        self.specs = data.get("specs")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Product as a search result dict; missing optional fields are left out"""
+        result = {"category": self.category, "name": self.name}
+        for key in ("brand", "price", "currency", "rating", "in_stock", "specs"):
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = value
+        return result
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """Pickler writing NumPy arrays to a separate array file by reference"""
+
+    def __init__(self, file: BinaryIO, arrays: BinaryIO):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = arrays
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple[str, int, str, Tuple[int, ...]]]:
+        if not isinstance(obj, np.ndarray):
+            return None
+        offset = self.arrays.tell()
+        padding = -offset % SNAPSHOT_ALIGNMENT
+        self.arrays.write(b"\0" * padding)
+        self.arrays.write(np.ascontiguousarray(obj).tobytes())
+        return "array", offset + padding, obj.dtype.str, obj.shape
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """Unpickler resolving array references to read-only views of a memory map"""
+
+    def __init__(self, file: BinaryIO, arrays: mmap.mmap):
+        super().__init__(file)
+        self.arrays = arrays
+
+    def persistent_load(self, pid: Tuple[str, int, str, Tuple[int, ...]]) -> np.ndarray:
+        _, offset, dtype, shape = pid
+        count = int(np.prod(shape))
+        return np.frombuffer(self.arrays, dtype=np.dtype(dtype), count=count, offset=offset).reshape(shape)
+
+
+class Catalog:
+    """Read-only view of the product data with precomputed indexes"""
+
+    def __init__(self, products_by_category: Dict[str, List[Dict[str, Any]]], version: int = 1):
+        # Bumped on every rebuild so cached results for older data go stale
+        self.version = version
+        # Hash of the source data; unlike version it is the same in every
+        # process and across restarts, so it keys the persistent cache
+        self.fingerprint = f"{stable_hash(json.dumps(products_by_category, sort_keys=True)):016x}"
+        # Product ids follow category order and list order, so sorting ids
+        # reproduces the iteration order of the source data.
+        self.products: List[Product] = []
+        self.categories: List[str] = list(products_by_category)
+        self.category_ids: Dict[str, range] = {}
+        self.search_text: List[Tuple[str, str]] = []
+        self.index = TokenIndex()
+        self.name_trigrams = TrigramIndex()
+        self.brand_trigrams = TrigramIndex()
+        self.ranking = BM25Index(RANKING_FIELDS)
+
+        for category in self.categories:
+            start = len(self.products)
+            for data in products_by_category[category]:
+                product = Product(len(self.products), category, data)
+                name = product.name.lower()
+                brand = (product.brand or "").lower()
+                self.products.append(product)
+                self.search_text.append((name, brand))
+                self.index.add(product.id, name)
+                self.index.add(product.id, brand)
+                self.name_trigrams.add(product.id, name)
+                self.brand_trigrams.add(product.id, brand)
+                self.ranking.add({
+                    "name": name,
+                    "brand": brand,
+                    "specs": " ".join(str(value) for value in (product.specs or {}).values()),
+                })
+            self.category_ids[category] = range(start, len(self.products))
+        self.index.finalize()
+        self.name_trigrams.finalize()
+        self.brand_trigrams.finalize()
+        self.ranking.finalize()
+
+        # Vocabulary of name and brand words for typo-tolerant lookups
+        self.spelling = SpellIndex()
+        for token, posting in self.index.postings.items():
+            if not token.isdigit():
+                self.spelling.add(token, len(posting))
+        self.spelling.finalize()
+
+        # Numeric columns, one entry per product id, for vectorized filtering
+        size = len(self.products)
+        self.price = np.fromiter((p.price for p in self.products), dtype=np.float64, count=size)
+        self.rating = np.fromiter((p.rating or 0 for p in self.products), dtype=np.float64, count=size)
+        self.in_stock = np.fromiter((bool(p.in_stock) for p in self.products), dtype=np.bool_, count=size)
+        self.name_hash = np.fromiter((stable_hash(p.name) for p in self.products), dtype=np.uint64, count=size)
+        self.category_code = np.empty(size, dtype=np.int32)
+        for code, category in enumerate(self.categories):
+            ids = self.category_ids[category]
+            self.category_code[ids.start:ids.stop] = code
+
+        # Per-category secondary indexes: ids sorted by price ascending and by
+        # rating descending (stable, so ties keep catalog order) alongside the
+        # sorted keys for binary search. Ratings are negated to sort ascending.
+        self.price_index: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.rating_index: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for category, ids in self.category_ids.items():
+            prices = self.price[ids.start:ids.stop]
+            order = np.argsort(prices, kind="stable")
+            self.price_index[category] = (order + ids.start, prices[order])
+            ratings = -self.rating[ids.start:ids.stop]
+            order = np.argsort(ratings, kind="stable")
+            self.rating_index[category] = (order + ids.start, ratings[order])
+
+        # Facet columns: brand and price bucket codes per product id, plus the
+        # facet counts of every unfiltered category, so browsing a category
+        # needs no counting at all.
+        self.brands: List[str] = sorted({p.brand or "N/A" for p in self.products})
+        brand_codes = {brand: code for code, brand in enumerate(self.brands)}
+        self.brand_code = np.fromiter(
+            (brand_codes[p.brand or "N/A"] for p in self.products), dtype=np.int32, count=size
+        )
+        self.price_bucket = np.searchsorted(PRICE_BUCKET_EDGES, self.price, side="right").astype(np.int32)
+        self.category_facets: Dict[str, Dict[str, Dict[str, int]]] = {
+            category: self.facet_counts(np.arange(ids.start, ids.stop))
+            for category, ids in self.category_ids.items()
+        }
+        self.category_facets["all"] = self.facet_counts(np.arange(size))
+
+        # Spec attributes: a numeric column per attribute (NaN when the product
+        # lacks it) with ids sorted by value for range queries, and a token
+        # index over color values.
+        self.attributes: Dict[str, np.ndarray] = {}
+        self.attribute_index: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for attribute, (keys, units) in SPEC_ATTRIBUTES.items():
+            column = np.full(size, np.nan)
+            for product in self.products:
+                for key in keys:
+                    value = (product.specs or {}).get(key)
+                    parsed = None if value is None else parse_spec_value(value, units)
+                    if parsed is not None:
+                        column[product.id] = parsed
+                        break
+            order = np.flatnonzero(~np.isnan(column))
+            order = order[np.argsort(column[order], kind="stable")]
+            self.attributes[attribute] = column
+            self.attribute_index[attribute] = (order, column[order])
+        # Exact and prefix name lookups. Each name also has an alias with the
+        # brand toggled ("apple iphone ..." for "iPhone ...", "playstation 5"
+        # for "Sony PlayStation 5"); real names win exact lookups over aliases.
+        # Completions rank best rated first, then shorter names, then catalog
+        # order. Exact names are kept as sorted keys with the id of each.
+        name_ids: Dict[str, int] = {}
+        self.name_trie = PrefixTrie(k=AUTOCOMPLETE_LIMIT)
+        aliases = []
+        for product in self.products:
+            name = normalize_name(product.name)
+            name_ids.setdefault(name, product.id)
+            self.name_trie.add(name, product.id)
+            brand = normalize_name(product.brand or "")
+            if not brand or name == brand:
+                continue
+            if name.startswith(brand + " "):
+                aliases.append((name[len(brand) + 1:], product.id))
+            else:
+                aliases.append((f"{brand} {name}", product.id))
+        for alias, product_id in aliases:
+            name_ids.setdefault(alias, product_id)
+            self.name_trie.add(alias, product_id)
+        self.name_trie.finalize(lambda i: (-self.rating[i], len(self.products[i].name), i))
+        names = sorted(name_ids)
+        self.names = key_array(names)
+        self.name_ids = np.array([name_ids[name] for name in names], dtype=np.int32)
+
+        self.color_index = TokenIndex()
+        for product in self.products:
+            color = (product.specs or {}).get("color")
+            if color:
+                self.color_index.add(product.id, color)
+        self.color_index.finalize()
+
+    def save(self, path: str):
+        """
+        Write a snapshot of the compiled catalog to the directory path. The
+        NumPy columns, sorted indexes and compiled text indexes go into one
+        array file that load() memory-maps, so processes loading the same
+        snapshot share them; only the products and small tables are pickled.
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, SNAPSHOT_INDEXES), "wb") as file, \
+                open(os.path.join(path, SNAPSHOT_ARRAYS), "wb") as arrays:
+            _SnapshotPickler(file, arrays).dump(self)
+            # mmap cannot map an empty file
+            if arrays.tell() == 0:
+                arrays.write(b"\0")
+
+    @classmethod
+    def load(cls, path: str, version: int = 1) -> "Catalog":
+        """
+        Catalog from a snapshot written by save(), without parsing or indexing.
+        Arrays are read-only views of the shared memory-mapped array file; the
+        products and small tables are unpickled into this process.
+        """
+        with open(os.path.join(path, SNAPSHOT_ARRAYS), "rb") as arrays:
+            # The mapping stays valid after the file is closed
+            shared = mmap.mmap(arrays.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(os.path.join(path, SNAPSHOT_INDEXES), "rb") as file:
+            catalog = _SnapshotUnpickler(file, shared).load()
+        catalog.version = version
+        return catalog
+
+    def candidates(self, needle: str) -> Optional[List[int]]:
+        """
+        Sorted ids of products that may contain the lowercased needle in their
+        name or brand, or None when the needle cannot narrow the search.
+        """
+        names = self.name_trigrams.candidates(needle)
+        if names is not None:
+            brands = self.brand_trigrams.candidates(needle)
+            return sorted(set(names).union(brands))
+
+        # Needles shorter than a trigram go through the token vocabulary
+        ids = self.index.candidates(needle)
+        return None if ids is None else sorted(ids)
+
+    def facet_counts(self, ids: np.ndarray) -> Dict[str, Dict[str, int]]:
+        """Counts of ids per category, brand, price bucket and stock status"""
+        columns = [
+            ("category", self.category_code, self.categories),
+            ("brand", self.brand_code, self.brands),
+            ("price", self.price_bucket, PRICE_BUCKET_LABELS),
+            ("in_stock", self.in_stock.astype(np.int32), ["No", "Yes"]),
+        ]
+        facets = {}
+        for facet, column, labels in columns:
+            counts = np.bincount(column[ids], minlength=len(labels))
+            facets[facet] = {labels[code]: int(count) for code, count in enumerate(counts) if count}
+        return facets
+
+    def facets(self, query: str, category: str = "all", max_price: Optional[float] = None,
+               min_rating: Optional[float] = 0, specs: Optional[Dict[str, Any]] = None
+               ) -> Dict[str, Dict[str, int]]:
+        """Facet counts over every product matching a search"""
+        unfiltered = not query and not max_price and not min_rating and not specs
+        if unfiltered and category in self.category_facets:
+            return self.category_facets[category]
+        ids = np.asarray(self.search(query, category, max_price, min_rating, specs=specs), dtype=np.int64)
+        return self.facet_counts(ids)
+
+    def find_by_name(self, product_name: str) -> Optional[Product]:
+        """First product, in catalog order, whose name contains product_name"""
+        needle = product_name.lower()
+        ids = self.name_trigrams.candidates(needle)
+        if ids is None:
+            ids = range(len(self.products))
+        for product_id in ids:
+            if needle in self.search_text[product_id][0]:
+                return self.products[product_id]
+        return None
+
+    def complete(self, prefix: str, limit: Optional[int] = None) -> List[int]:
+        """Ids of the best products whose name (or brand and name) starts with prefix"""
+        return self.name_trie.complete(normalize_name(prefix), limit)
+
+    def resolve_name(self, product_name: str) -> Optional[Product]:
+        """
+        Product for a name: an exact (normalized) match first, then the best
+        prefix completion, then the first product whose name contains it
+        """
+        name = normalize_name(product_name)
+        position = find_key(self.names, name)
+        product_id = None if position < 0 else int(self.name_ids[position])
+        if product_id is None and name:
+            completions = self.name_trie.complete(name, 1)
+            if completions:
+                product_id = completions[0]
+        if product_id is not None:
+            return self.products[product_id]
+        return self.find_by_name(product_name)
+
+    def correct(self, query: str) -> Optional[str]:
+        """
+        Query with misspelled words replaced by their closest vocabulary words,
+        lowercased, or None when no word could be corrected. Short words and
+        words found inside some vocabulary word are valid fragments, not typos.
+        """
+        changed = False
+
+        def replace(match) -> str:
+            nonlocal changed
+            word = match.group(0)
+            if word.isdigit() or len(word) < MIN_CORRECTION_LENGTH or self.index.containing(word):
+                return word
+            suggestion = self.spelling.lookup(word)
+            if suggestion is None or suggestion == word:
+                return word
+            changed = True
+            return suggestion
+
+        corrected = TOKEN_RE.sub(replace, query.lower())
+        return corrected if changed else None
+
+    def spec_ids(self, specs: Optional[Dict[str, Any]]) -> Optional[List[int]]:
+        """
+        Sorted ids of products matching every spec filter, or None when no
+        spec filter is set
+        """
+        result: Optional[np.ndarray] = None
+        for name, value in (specs or {}).items():
+            if value is None:
+                continue
+            if name == "color":
+                # Every word of the color must appear in the product color
+                postings = [self.color_index.postings.get(token, []) for token in tokenize(str(value))]
+                if not postings:
+                    continue
+                ids = np.asarray(min(postings, key=len), dtype=np.int64)
+                for posting in postings:
+                    ids = np.intersect1d(ids, posting)
+            elif name in SPEC_FILTERS:
+                attribute, bound = SPEC_FILTERS[name]
+                order, keys = self.attribute_index[attribute]
+                if bound == "min":
+                    ids = np.sort(order[np.searchsorted(keys, value, side="left"):])
+                else:
+                    ids = np.sort(order[:np.searchsorted(keys, value, side="right")])
+            else:
+                raise ValueError(f"Unknown spec filter: {name}")
+            result = ids if result is None else np.intersect1d(result, ids)
+        return None if result is None else result.tolist()
+
+    def range_ids(self, category: str, max_price: Optional[float] = None,
+                  min_rating: Optional[float] = 0) -> Optional[np.ndarray]:
+        """
+        Ids in category passing the most selective range filter, in sort-index
+        order, or None when no range filter is set
+        """
+        ranges = []
+        if max_price:
+            order, keys = self.price_index[category]
+            ranges.append(order[:np.searchsorted(keys, max_price, side="right")])
+        if min_rating:
+            order, keys = self.rating_index[category]
+            ranges.append(order[:np.searchsorted(keys, -min_rating, side="right")])
+        if not ranges:
+            return None
+        return min(ranges, key=len)
+
+    def apply_filters(self, ids: np.ndarray, max_price: Optional[float] = None,
+                      min_rating: Optional[float] = 0) -> np.ndarray:
+        """Subset of ids passing the price and rating filters, order preserved"""
+        if max_price:
+            ids = ids[self.price[ids] <= max_price]
+        if min_rating:
+            ids = ids[self.rating[ids] >= min_rating]
+        return ids
+
+    def sort_key(self, sort_by: str, query: str = ""):
+        """Key function ordering product ids for sort_by, ties in catalog order"""
+        if sort_by == "price":
+            price = self.price
+            return lambda product_id: (price[product_id], product_id)
+        if sort_by == "rating":
+            rating = self.rating
+            return lambda product_id: (-rating[product_id], product_id)
+        if sort_by == "relevance":
+            terms = tokenize(query)
+            score = self.ranking.score
+            return lambda product_id: (-score(product_id, terms), product_id)
+        raise ValueError(f"Unknown sort order: {sort_by}")
+
+    def search(self, query: str, category: str = "all", max_price: Optional[float] = None,
+               min_rating: Optional[float] = 0, sort_by: Optional[str] = None,
+               limit: Optional[int] = None, specs: Optional[Dict[str, Any]] = None) -> List[int]:
+        """
+        Ids of products whose name or brand contains query and which pass the
+        price, rating and spec filters (see SPEC_FILTERS, plus "color").
+        Results are in catalog order unless sort_by is "price" (cheapest
+        first), "rating" (best rated first) or "relevance" (best BM25 match
+        first); at most limit ids are returned.
+        """
+        if category == "all":
+            categories = self.categories
+        else:
+            categories = [category] if category in self.category_ids else []
+
+        needle = query.lower()
+        search_text = self.search_text
+
+        def matches(product_id: int) -> bool:
+            # Postings only narrow the search; the substring check keeps
+            # results identical to a full scan.
+            name, brand = search_text[product_id]
+            return needle in name or needle in brand
+
+        candidates = self.candidates(needle)
+        spec_ids = self.spec_ids(specs)
+        if spec_ids is not None:
+            candidates = spec_ids if candidates is None else intersect_sorted(candidates, spec_ids)
+
+        if candidates is None and sort_by in ("price", "rating"):
+            # Nothing narrows the text side: walk the per-category sort
+            # indexes lazily and merge them, stopping after limit matches.
+            streams = [self._sorted_stream(cat, sort_by, max_price, min_rating) for cat in categories]
+            merged = heapq.merge(*streams, key=self.sort_key(sort_by))
+            return list(islice((i for i in merged if matches(i)), limit))
+
+        # Ids in catalog order, as arrays or, for unfiltered categories, ranges
+        parts: List[Any] = []
+        if candidates is not None:
+            ids = np.asarray(candidates, dtype=np.int64)
+            if category != "all":
+                scope = self.category_ids.get(category, range(0))
+                ids = ids[np.searchsorted(ids, scope.start):np.searchsorted(ids, scope.stop)]
+            parts.append(self.apply_filters(ids, max_price, min_rating))
+        else:
+            for cat in categories:
+                ranged = self.range_ids(cat, max_price, min_rating)
+                if ranged is None:
+                    parts.append(self.category_ids[cat])
+                else:
+                    parts.append(np.sort(self.apply_filters(ranged, max_price, min_rating)))
+
+        found = (product_id for part in parts for product_id in iter_ids(part) if matches(product_id))
+        if sort_by:
+            key = self.sort_key(sort_by, needle)
+            if limit is None:
+                return sorted(found, key=key)
+            return heapq.nsmallest(limit, found, key=key)
+        return list(islice(found, limit))
+
+    def _sorted_stream(self, category: str, sort_by: str, max_price: Optional[float],
+                       min_rating: Optional[float]) -> Iterator[int]:
+        """
+        Ids of category in sort_by order, restricted by the range filters.
+        The sort index is walked ID_CHUNK ids at a time, so a consumer that
+        stops early never touches the rest of it.
+        """
+        if sort_by == "price":
+            order, keys = self.price_index[category]
+            if max_price:
+                order = order[:np.searchsorted(keys, max_price, side="right")]
+        else:
+            order, keys = self.rating_index[category]
+            if min_rating:
+                order = order[:np.searchsorted(keys, -min_rating, side="right")]
+        for start in range(0, len(order), ID_CHUNK):
+            chunk = self.apply_filters(order[start:start + ID_CHUNK], max_price, min_rating)
+            yield from chunk.tolist()
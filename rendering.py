@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Rendering of tool responses. Markdown renderers collect their parts in a list
+and join them once, so output size grows linearly with the result set; the
+JSON formats build plain structures serialized with orjson.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import orjson
+
+from catalog import Product
+
+# Output formats accepted by every tool: emoji markdown for people, JSON
+# objects for programs, and columnar JSON that names each field only once
+FORMATS = ["markdown", "json", "compact"]
+
+# Fields of structured products and offers, in column order
+PRODUCT_FIELDS = ["name", "brand", "price", "currency", "rating", "in_stock", "category", "specs"]
+OFFER_FIELDS = [
+    "store", "store_id", "price", "currency", "in_stock", "delivery_days", "rating", "reviews_count",
+    "url", "special_offer"
+]
+SUGGESTION_FIELDS = ["name", "brand", "price", "currency"]
+
+# Upper bound on memoized per-product blocks
+PRODUCT_BLOCK_CACHE_SIZE = 8192
+
+# Per-tool templates, formatted with str.format
+SEARCH_CORRECTED = "No exact matches for '{query}', showing results for '{corrected}'.\n\n"
+SEARCH_HEADER = "Found {count} products:\n\n"
+SEARCH_PAGE_HEADER = "Showing products {first}-{last}:\n\n"
+SEARCH_MORE = "More results available: call again with cursor \"{cursor}\"\n"
+SEARCH_PRODUCT = (
+    "   Brand: {brand}\n"
+    "   Price: {price} {currency}\n"
+    "   Rating: ⭐ {rating}\n"
+    "   In Stock: {in_stock}\n"
+    "   Category: {category}\n"
+)
+SEARCH_SPEC = "     • {key}: {value}\n"
+SEARCH_FACETS = (
+    "**Refine your search:**\n"
+    "   Categories: {categories}\n"
+    "   Brands: {brands}\n"
+    "   Price (AED): {price}\n"
+    "   In Stock: {in_stock}\n"
+)
+
+COMPARE_HEADER = "**Price Comparison for {name}**\n\n"
+COMPARE_BEST = "Found {count} offers:\n\n🏆 **Best Price: {store} - {price} {currency}**\n\nAll offers:\n\n"
+COMPARE_OFFER = (
+    "{index}. **{store}**\n"
+    "   Price: {price} {currency}{special}\n"
+    "   In Stock: {in_stock}\n"
+    "   Delivery: {delivery_days} days\n"
+    "   Rating: ⭐ {rating} ({reviews_count} reviews)\n"
+    "   Link: {url}\n\n"
+)
+
+BATCH_HEADER = "**Price Comparison for {count} products**\n\n"
+BATCH_BEST = "   🏆 Best Price: {store} - {price} {currency}\n"
+BATCH_OFFER = "   • {store}: {price} {currency}{special} | {in_stock} | {delivery_days} days | ⭐ {rating} | {url}\n"
+
+AUTOCOMPLETE_ITEM = "{index}. {name} ({brand}, {price} {currency})\n"
+
+STORE_INFO = (
+    "\n📍 Number of locations in UAE: {locations}\n"
+    "🚚 Free delivery from: {free_delivery_from} AED\n"
+    "💳 Payment methods: Cards, Cash, Apple Pay, Samsung Pay\n"
+    "📞 Customer service: 800-{phone}\n"
+    "🌐 Website: https://{store_id}.ae\n"
+    "⏰ Operating hours: 9 AM - 12 AM\n"
+    "🛍️ Online shopping: Available\n"
+    "📱 Mobile app: Available on iOS & Android\n"
+)
+
+
+def label(key: str) -> str:
+    """Human-readable form of a snake_case key"""
+    return key.replace("_", " ").title()
+
+
+def counts(items: Iterable, title: bool = False) -> str:
+    """Comma-separated 'value (count)' list"""
+    return ", ".join(f"{value.title() if title else value} ({count})" for value, count in items)
+
+
+def special(offer: Dict[str, Any]) -> str:
+    """Special offer suffix of an offer line"""
+    return f" 🔥 {offer['special_offer']}" if offer.get("special_offer") else ""
+
+
+def offer_values(offer: Dict[str, Any]) -> Dict[str, Any]:
+    """Template values of an offer: OFFER_FIELDS only, missing ones as N/A"""
+    values = {field: "N/A" if offer.get(field) is None else offer[field] for field in OFFER_FIELDS}
+    values["in_stock"] = "✅" if offer.get("in_stock") else "❌"
+    return values
+
+
+@lru_cache(maxsize=PRODUCT_BLOCK_CACHE_SIZE)
+def product_block(product: Product) -> str:
+    """
+    Search result lines of a product after its numbered title. Products are
+    immutable once the catalog is built, so each block is rendered only once.
+    """
+    parts = [SEARCH_PRODUCT.format(
+        brand=product.brand if product.brand is not None else "N/A",
+        price=product.price,
+        currency=product.currency,
+        rating=product.rating if product.rating is not None else "N/A",
+        in_stock="✅ Yes" if product.in_stock else "❌ No",
+        category=product.category.title(),
+    )]
+    if product.specs:
+        parts.append("   Specifications:\n")
+        parts.extend(SEARCH_SPEC.format(key=label(key), value=value) for key, value in product.specs.items())
+    parts.append("\n")
+    return "".join(parts)
+
+
+def search_entry(index: int, product: Product) -> str:
+    """Numbered search result entry of a product"""
+    return f"{index}. **{product.name}**\n{product_block(product)}"
+
+
+def search_entry_sizes(products: Sequence[Product], start: int, output_format: str) -> Iterator[int]:
+    """Encoded size in bytes of each search result entry, computed lazily"""
+    for i, product in enumerate(products, start):
+        if output_format == "markdown":
+            yield len(search_entry(i, product).encode())
+        else:
+            yield len(encode(product_record(product))) + 1
+
+
+def take_within(sizes: Iterable[int], budget: int) -> int:
+    """Number of leading items whose sizes fit in budget; at least one"""
+    total = 0
+    count = 0
+    for size in sizes:
+        total += size
+        if total > budget and count:
+            break
+        count += 1
+    return count
+
+
+def offer_line(offer: Dict[str, Any]) -> str:
+    """One-line summary of an offer"""
+    return BATCH_OFFER.format(special=special(offer), **offer_values(offer))
+
+
+def offer_record(offer: Dict[str, Any]) -> Dict[str, Any]:
+    """Structured form of an offer"""
+    return {field: offer.get(field) for field in OFFER_FIELDS}
+
+
+def preview_products(products: Sequence[Product], output_format: str) -> str:
+    """Short list of products sent ahead of a full response"""
+    if output_format != "markdown":
+        return encode([product_record(product) for product in products])
+    return "Best matches: " + ", ".join(f"{product.name} ({product.price} {product.currency})" for product in products)
+
+
+def preview_offer(offer: Dict[str, Any], output_format: str) -> str:
+    """Single offer sent ahead of a full response"""
+    if output_format != "markdown":
+        return encode(offer_record(offer))
+    return offer_line(offer).strip()
+
+
+def preview_best_offer(product: Product, offer: Dict[str, Any], output_format: str) -> str:
+    """Best offer for one product of a batch, sent ahead of the full response"""
+    if output_format != "markdown":
+        return encode({"product": product.name, "offer": offer_record(offer)})
+    return f"{product.name}: {offer_line(offer).strip()}"
+
+
+def render_search(products: Sequence[Product], query: str, corrected: Optional[str] = None,
+                  facets: Optional[Dict[str, Dict[str, int]]] = None, start: int = 1,
+                  next_cursor: Optional[str] = None) -> str:
+    """search_products response; products are numbered from start"""
+    parts: List[str] = []
+    if corrected:
+        parts.append(SEARCH_CORRECTED.format(query=query, corrected=corrected))
+    if start == 1 and next_cursor is None:
+        parts.append(SEARCH_HEADER.format(count=len(products)))
+    else:
+        parts.append(SEARCH_PAGE_HEADER.format(first=start, last=start + len(products) - 1))
+    parts.extend(search_entry(i, product) for i, product in enumerate(products, start))
+    if facets is not None:
+        parts.append(SEARCH_FACETS.format(
+            categories=counts(facets["category"].items(), title=True),
+            brands=counts(sorted(facets["brand"].items(), key=lambda x: -x[1])),
+            price=counts(facets["price"].items()),
+            in_stock=counts(facets["in_stock"].items()),
+        ))
+    if next_cursor is not None:
+        parts.append(SEARCH_MORE.format(cursor=next_cursor))
+    return "".join(parts)
+
+
+def render_comparison(product: Product, offers: Sequence[Dict[str, Any]], unavailable: Sequence[str]) -> str:
+    """compare_prices response"""
+    parts = [COMPARE_HEADER.format(name=product.name)]
+    if not offers:
+        parts.append("Sorry, this product is temporarily out of stock in all stores.")
+    else:
+        best_price = offers[0]
+        parts.append(COMPARE_BEST.format(count=len(offers), **offer_values(best_price)))
+        parts.extend(
+            COMPARE_OFFER.format(index=i, special=special(offer), **offer_values(offer))
+            for i, offer in enumerate(offers, 1)
+        )
+    if unavailable:
+        parts.append(f"\n⚠️ No response from: {', '.join(unavailable)}\n")
+    return "".join(parts)
+
+
+def render_batch(products: Sequence[Product], offers_per_product: Sequence[Sequence[Dict[str, Any]]],
+                 not_found: Sequence[str], unavailable: Sequence[str]) -> str:
+    """compare_prices_batch response; offers are already filtered by availability"""
+    parts = [BATCH_HEADER.format(count=len(products))]
+    total = 0
+    currency = None
+
+    for i, (product, offers) in enumerate(zip(products, offers_per_product), 1):
+        parts.append(f"{i}. **{product.name}**\n")
+        if not offers:
+            parts.append("   Temporarily out of stock in all stores.\n\n")
+            continue
+
+        best_price = offers[0]
+        # The total counts what can be bought: the cheapest in-stock offer
+        best_in_stock = next((offer for offer in offers if offer["in_stock"]), None)
+        if best_in_stock:
+            total += best_in_stock["price"]
+            currency = best_in_stock["currency"]
+        parts.append(BATCH_BEST.format(**offer_values(best_price)))
+        parts.extend(map(offer_line, offers))
+        parts.append("\n")
+
+    if currency:
+        parts.append(f"💰 Total at best prices: {round(total, 2)} {currency}\n")
+    if not_found:
+        parts.append(f"Not found: {', '.join(not_found)}\n")
+    if unavailable:
+        parts.append(f"⚠️ No response from: {', '.join(unavailable)}\n")
+    return "".join(parts)
+
+
+def render_autocomplete(prefix: str, products: Sequence[Product]) -> str:
+    """autocomplete_products response"""
+    parts = [f"Suggestions for '{prefix}':\n"]
+    parts.extend(
+        AUTOCOMPLETE_ITEM.format(index=i, name=product.name, brand=product.brand or "N/A",
+                                 price=product.price, currency=product.currency)
+        for i, product in enumerate(products, 1)
+    )
+    return "".join(parts)
+
+
+def render_store_info(store_id: str, store: Dict[str, Any], locations: int, free_delivery_from: int,
+                      phone: int) -> str:
+    """get_store_info response"""
+    parts = [f"**{store['name']} Store Information**\n\n", "Product Categories:\n"]
+    parts.extend(f"• {label(category)}\n" for category in store["categories"])
+    parts.append(STORE_INFO.format(locations=locations, free_delivery_from=free_delivery_from,
+                                   phone=phone, store_id=store_id))
+    return "".join(parts)
+
+
+def encode(data: Any) -> str:
+    """Serialize a structured response"""
+    return orjson.dumps(data).decode()
+
+
+def table(records: Iterable[Dict[str, Any]], fields: List[str], compact: bool) -> Any:
+    """Records as a list of objects, or as columns plus rows when compact"""
+    if compact:
+        return {"columns": fields, "rows": [[record.get(field) for field in fields] for record in records]}
+    return [{field: record.get(field) for field in fields} for record in records]
+
+
+def product_record(product: Product) -> Dict[str, Any]:
+    """Structured form of a product"""
+    return {field: getattr(product, field) for field in PRODUCT_FIELDS}
+
+
+def search_data(products: Sequence[Product], query: str, corrected: Optional[str] = None,
+                facets: Optional[Dict[str, Dict[str, int]]] = None, compact: bool = False,
+                offset: int = 0, next_cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Structured search_products response"""
+    data: Dict[str, Any] = {"query": query}
+    if corrected:
+        data["corrected"] = corrected
+    if offset:
+        data["offset"] = offset
+    data["count"] = len(products)
+    data["products"] = table(map(product_record, products), PRODUCT_FIELDS, compact)
+    if facets is not None:
+        data["facets"] = facets
+    if next_cursor is not None:
+        data["next_cursor"] = next_cursor
+    return data
+
+
+def comparison_data(product: Product, offers: Sequence[Dict[str, Any]], unavailable: Sequence[str],
+                    compact: bool = False) -> Dict[str, Any]:
+    """Structured compare_prices response; offers are cheapest first"""
+    return {
+        "product": product.name,
+        "offers": table(offers, OFFER_FIELDS, compact),
+        "unavailable": list(unavailable),
+    }
+
+
+def batch_data(products: Sequence[Product], offers_per_product: Sequence[Sequence[Dict[str, Any]]],
+               not_found: Sequence[str], unavailable: Sequence[str], compact: bool = False) -> Dict[str, Any]:
+    """Structured compare_prices_batch response"""
+    total = 0
+    currency = None
+    for offers in offers_per_product:
+        best_in_stock = next((offer for offer in offers if offer["in_stock"]), None)
+        if best_in_stock:
+            total += best_in_stock["price"]
+            currency = best_in_stock["currency"]
+    return {
+        "products": [
+            {"product": product.name, "offers": table(offers, OFFER_FIELDS, compact)}
+            for product, offers in zip(products, offers_per_product)
+        ],
+        "total": round(total, 2) if currency else None,
+        "currency": currency,
+        "not_found": list(not_found),
+        "unavailable": list(unavailable),
+    }
+
+
+def autocomplete_data(prefix: str, products: Sequence[Product], compact: bool = False) -> Dict[str, Any]:
+    """Structured autocomplete_products response"""
+    return {"prefix": prefix, "suggestions": table(map(product_record, products), SUGGESTION_FIELDS, compact)}
+
+
+def store_info_data(store_id: str, store: Dict[str, Any], locations: int, free_delivery_from: int,
+                    phone: int) -> Dict[str, Any]:
+    """Structured get_store_info response"""
+    return {
+        "store": store_id,
+        "name": store["name"],
+        "categories": store["categories"],
+        "locations": locations,
+        "free_delivery_from": free_delivery_from,
+        "customer_service": f"800-{phone}",
+        "website": f"https://{store_id}.ae",
+    }
+
+
+def error_data(message: str) -> Dict[str, Any]:
+    """Structured error response"""
+    return {"error": message}
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Text indexes used by the shopping assistant product search. Each index is
+built with add() and then compiled by finalize() into flat NumPy arrays, so a
+memory-mapped catalog snapshot shares them between processes.
+"""
+
+import math
+import re
+from bisect import bisect_left
+from itertools import chain
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Tokens are maximal runs of word characters. Splitting the query and the
+# indexed text the same way guarantees that every query token of a substring
+# match lies inside some token of the matched text.
+TOKEN_RE = re.compile(r"\w+")
+
+# Upper bound on memoized fragment expansions kept by a TokenIndex
+MAX_EXPANSIONS = 4096
+
+# Length of the character n-grams kept by a TrigramIndex
+NGRAM = 3
+
+
+def tokenize(text: str) -> List[str]:
+    """Split lowercased text into word tokens"""
+    return TOKEN_RE.findall(text.lower())
+
+
+def ngrams(text: str, n: int = NGRAM) -> Set[str]:
+    """Distinct character n-grams of text"""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def key_array(keys: Iterable[str]) -> np.ndarray:
+    """
+    Keys as a NumPy array of UTF-8 byte strings. Sorted str keys stay sorted,
+    as UTF-8 preserves code point order.
+    """
+    encoded = [key.encode() for key in keys]
+    return np.array(encoded, dtype=np.bytes_) if encoded else np.empty(0, dtype="S1")
+
+
+def find_key(keys: np.ndarray, key: str) -> int:
+    """Position of key in a sorted key_array, or -1"""
+    encoded = key.encode()
+    position = int(np.searchsorted(keys, encoded))
+    if position < len(keys) and keys[position] == encoded:
+        return position
+    return -1
+
+
+class PostingLists:
+    """
+    Id lists by key in CSR form: key i of the sorted keys array owns
+    values[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, lists: Dict[str, List[int]]):
+        keys = sorted(lists)
+        self.keys = key_array(keys)
+        self.offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(lists[key]) for key in keys], out=self.offsets[1:])
+        self.values = np.fromiter(
+            chain.from_iterable(lists[key] for key in keys), dtype=np.int32, count=int(self.offsets[-1])
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def posting(self, position: int) -> np.ndarray:
+        """Ids of the key at position"""
+        return self.values[self.offsets[position]:self.offsets[position + 1]]
+
+    def get(self, key: str, default=None):
+        """Ids of key, or default when it has none"""
+        position = find_key(self.keys, key)
+        return default if position < 0 else self.posting(position)
+
+    def items(self) -> Iterator[Tuple[str, np.ndarray]]:
+        """(key, ids) pairs in key order"""
+        for position, key in enumerate(self.keys.tolist()):
+            yield key.decode(), self.posting(position)
+
+
+def intersect_sorted(small: List[int], large: List[int]) -> List[int]:
+    """Intersect two sorted id lists in O(len(small) * log(len(large)))"""
+    result = []
+    lo = 0
+    for doc_id in small:
+        lo = bisect_left(large, doc_id, lo)
+        if lo == len(large):
+            break
+        if large[lo] == doc_id:
+            result.append(doc_id)
+    return result
+
+
+class TokenIndex:
+    """Inverted index: token -> sorted list of document ids"""
+
+    def __init__(self):
+        self.postings = PostingLists({})
+        # Trigrams of the vocabulary: gram -> positions of the tokens having it
+        self.vocabulary = TrigramIndex()
+        self._lists: Dict[str, List[int]] = {}
+        self._expansions: Dict[str, FrozenSet[int]] = {}
+
+    def __getstate__(self):
+        # The memo is rebuilt on demand in every process
+        return {**self.__dict__, "_expansions": {}}
+
+    def add(self, doc_id: int, text: str):
+        """Index text under doc_id (ids must be added in increasing order)"""
+        for token in set(tokenize(text)):
+            posting = self._lists.setdefault(token, [])
+            if not posting or posting[-1] != doc_id:
+                posting.append(doc_id)
+
+    def finalize(self):
+        """Compile the postings; no documents can be added afterwards"""
+        self.postings = PostingLists(self._lists)
+        del self._lists
+        for position, token in enumerate(self.postings.keys.tolist()):
+            self.vocabulary.add(position, token.decode())
+        self.vocabulary.finalize()
+        self._expansions.clear()
+
+    def containing(self, fragment: str) -> FrozenSet[int]:
+        """Ids of documents having a token that contains fragment"""
+        ids = self._expansions.get(fragment)
+        if ids is None:
+            # Fragments with trigrams only check the tokens sharing all of
+            # them; shorter ones scan the vocabulary, which is much smaller
+            # than the catalog. Either way the result is memoized.
+            positions = self.vocabulary.candidates(fragment)
+            if positions is None:
+                matched = np.flatnonzero(np.char.find(self.postings.keys, fragment.encode()) >= 0).tolist()
+            else:
+                keys = self.postings.keys
+                matched = [i for i in positions if fragment in keys[i].decode()]
+            ids = frozenset(chain.from_iterable(self.postings.posting(i).tolist() for i in matched))
+            if len(self._expansions) >= MAX_EXPANSIONS:
+                self._expansions.clear()
+            self._expansions[fragment] = ids
+        return ids
+
+    def candidates(self, query: str) -> Optional[FrozenSet[int]]:
+        """
+        Ids of documents that may contain query as a substring.
+        Returns None when the query has no tokens and cannot narrow the search.
+        """
+        fragments = set(tokenize(query))
+        if not fragments:
+            return None
+
+        sets = sorted((self.containing(fragment) for fragment in fragments), key=len)
+        result = sets[0]
+        for ids in sets[1:]:
+            if not result:
+                break
+            result = result & ids
+        return result
+
+
+class TrigramIndex:
+    """Character trigram index answering substring queries over one text field"""
+
+    def __init__(self):
+        self.postings = PostingLists({})
+        self._lists: Dict[str, List[int]] = {}
+
+    def add(self, doc_id: int, text: str):
+        """Index lowercased text under doc_id (ids must be added in increasing order)"""
+        for gram in ngrams(text):
+            self._lists.setdefault(gram, []).append(doc_id)
+
+    def finalize(self):
+        """Compile the postings; no documents can be added afterwards"""
+        self.postings = PostingLists(self._lists)
+        del self._lists
+
+    def candidates(self, needle: str) -> Optional[List[int]]:
+        """
+        Sorted ids of documents containing every trigram of needle.
+        Returns None when needle is too short to have trigrams.
+        """
+        grams = ngrams(needle)
+        if not grams:
+            return None
+
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+
+        postings.sort(key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result.tolist()
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance between a and b (adjacent transpositions
+    count as one edit). Returns limit + 1 as soon as the distance exceeds limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def deletes(word: str, distance: int) -> Set[str]:
+    """All strings obtained from word by removing up to distance characters"""
+    result = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+class SpellIndex:
+    """
+    SymSpell deletion dictionary over a word vocabulary. A lookup generates the
+    deletes of the misspelled term only, so its cost depends on the term length
+    and the edit distance, never on the vocabulary size.
+    """
+
+    def __init__(self, max_distance: int = 2, max_term_length: int = 24):
+        self.max_distance = max_distance
+        self.max_term_length = max_term_length
+        # Sorted vocabulary, the frequency of each word, and the positions of
+        # the words each delete variant came from
+        self.words = key_array([])
+        self.frequency = np.empty(0, dtype=np.int64)
+        self.deletes = PostingLists({})
+        self._frequency: Dict[str, int] = {}
+
+    def add(self, word: str, frequency: int = 1):
+        """Add word to the vocabulary with the given frequency"""
+        self._frequency[word] = self._frequency.get(word, 0) + frequency
+
+    def finalize(self):
+        """Compile the vocabulary and its deletion dictionary"""
+        words = sorted(self._frequency)
+        variants: Dict[str, List[int]] = {}
+        for position, word in enumerate(words):
+            if len(word) <= self.max_term_length:
+                for variant in deletes(word, self.max_distance):
+                    variants.setdefault(variant, []).append(position)
+        self.words = key_array(words)
+        self.frequency = np.array([self._frequency[word] for word in words], dtype=np.int64)
+        self.deletes = PostingLists(variants)
+        del self._frequency
+
+    def distance_for(self, term: str) -> int:
+        """Edit distance allowed for term; short terms tolerate fewer typos"""
+        return min(self.max_distance, 1 if len(term) <= 4 else 2)
+
+    def lookup(self, term: str) -> Optional[str]:
+        """Closest vocabulary word to term, preferring frequent words on ties"""
+        if find_key(self.words, term) >= 0:
+            return term
+        if len(term) > self.max_term_length:
+            return None
+
+        limit = self.distance_for(term)
+        best = None
+        best_key = None
+        for variant in deletes(term, limit):
+            positions = self.deletes.get(variant)
+            if positions is None:
+                continue
+            for position in positions.tolist():
+                word = self.words[position].decode()
+                distance = edit_distance(term, word, limit)
+                if distance > limit:
+                    continue
+                key = (distance, -int(self.frequency[position]), word)
+                if best_key is None or key < best_key:
+                    best, best_key = word, key
+        return best
+
+
+class BM25Index:
+    """
+    BM25 relevance scores over weighted text fields. Term frequencies, document
+    lengths and document frequencies are collected while documents are added,
+    so scoring a candidate costs two binary searches per query term.
+    """
+
+    def __init__(self, field_weights: Dict[str, float], k1: float = 1.2, b: float = 0.75):
+        self.field_weights = field_weights
+        self.k1 = k1
+        self.b = b
+        self.average_length = 0.0
+        # Compiled by finalize(): the sorted vocabulary with the idf of each
+        # term, the length of each document, and per document its term
+        # positions (sorted) and weights in CSR form
+        self.terms = key_array([])
+        self.idf = np.empty(0, dtype=np.float64)
+        self.doc_offsets = np.zeros(1, dtype=np.int64)
+        self.doc_terms = np.empty(0, dtype=np.int32)
+        self.doc_weights = np.empty(0, dtype=np.float64)
+        self.lengths = np.empty(0, dtype=np.float64)
+        self._term_weights: List[Dict[str, float]] = []
+        self._lengths: List[float] = []
+        self._document_frequency: Dict[str, int] = {}
+
+    def add(self, fields: Dict[str, str]) -> int:
+        """Add a document given as field name -> text; returns its id"""
+        weights: Dict[str, float] = {}
+        length = 0.0
+        for field, text in fields.items():
+            weight = self.field_weights.get(field, 1.0)
+            for token in tokenize(text):
+                weights[token] = weights.get(token, 0.0) + weight
+                length += weight
+        for token in weights:
+            self._document_frequency[token] = self._document_frequency.get(token, 0) + 1
+        self._term_weights.append(weights)
+        self._lengths.append(length)
+        return len(self._term_weights) - 1
+
+    def finalize(self):
+        """
+        Precompute inverse document frequencies and the average length, and
+        compile the tables; no documents can be added afterwards
+        """
+        count = len(self._term_weights)
+        self.average_length = sum(self._lengths) / count if count else 0.0
+        terms = sorted(self._document_frequency)
+        positions = {term: position for position, term in enumerate(terms)}
+        self.terms = key_array(terms)
+        self.idf = np.array([
+            math.log(1 + (count - self._document_frequency[term] + 0.5) / (self._document_frequency[term] + 0.5))
+            for term in terms
+        ], dtype=np.float64)
+
+        documents = [sorted((positions[term], tf) for term, tf in weights.items()) for weights in self._term_weights]
+        self.doc_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(document) for document in documents], out=self.doc_offsets[1:])
+        self.doc_terms = np.array([position for document in documents for position, _ in document], dtype=np.int32)
+        self.doc_weights = np.array([tf for document in documents for _, tf in document], dtype=np.float64)
+        self.lengths = np.array(self._lengths, dtype=np.float64)
+        del self._term_weights, self._lengths, self._document_frequency
+
+    def score(self, doc_id: int, terms: List[str]) -> float:
+        """BM25 score of doc_id for the given query terms"""
+        start, stop = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        doc_terms = self.doc_terms[start:stop]
+        norm = self.k1 * (1 - self.b + self.b * float(self.lengths[doc_id]) / (self.average_length or 1.0))
+        total = 0.0
+        for term in terms:
+            position = find_key(self.terms, term)
+            if position < 0:
+                continue
+            at = int(np.searchsorted(doc_terms, position))
+            if at == len(doc_terms) or doc_terms[at] != position:
+                continue
+            tf = float(self.doc_weights[start + at])
+            if tf:
+                total += float(self.idf[position]) * tf * (self.k1 + 1) / (tf + norm)
+        return total
+
+
+class _TrieNode:
+    """Radix trie node: edges keyed by their first character"""
+
+    __slots__ = ("edges", "ids", "top")
+
+    def __init__(self):
+        self.edges: Dict[str, Tuple[str, "_TrieNode"]] = {}
+        self.ids: List[int] = []
+        self.top: List[int] = []
+
+
+class PrefixTrie:
+    """
+    Compressed (radix) trie over keys with the best k ids of every subtree
+    precomputed, so a prefix lookup costs O(len(prefix) + k). finalize()
+    compiles the nodes into arrays: node i owns the edges
+    edge_offsets[i]:edge_offsets[i + 1], sorted by label, and the top ids
+    top_offsets[i]:top_offsets[i + 1]. The root is node 0.
+    """
+
+    def __init__(self, k: int = 10):
+        self.k = k
+        self.root = _TrieNode()
+        self.edge_offsets = np.zeros(2, dtype=np.int64)
+        self.edge_labels = key_array([])
+        self.edge_children = np.empty(0, dtype=np.int32)
+        self.top_offsets = np.zeros(2, dtype=np.int64)
+        self.top = np.empty(0, dtype=np.int32)
+
+    def add(self, key: str, doc_id: int):
+        """Insert key for doc_id"""
+        node = self.root
+        while key:
+            edge = node.edges.get(key[0])
+            if edge is None:
+                child = _TrieNode()
+                node.edges[key[0]] = (key, child)
+                node = child
+                key = ""
+                break
+            label, child = edge
+            common = 0
+            limit = min(len(label), len(key))
+            while common < limit and label[common] == key[common]:
+                common += 1
+            if common < len(label):
+                # Split the edge at the end of the common part
+                middle = _TrieNode()
+                middle.edges[label[common]] = (label[common:], child)
+                node.edges[key[0]] = (label[:common], middle)
+                child = middle
+            node = child
+            key = key[common:]
+        node.ids.append(doc_id)
+
+    def finalize(self, rank):
+        """
+        Precompute the top k ids of every subtree, ordered by rank(doc_id), and
+        compile the nodes; no keys can be added afterwards
+        """
+        def visit(node: _TrieNode) -> List[int]:
+            ids = set(node.ids)
+            for _, child in node.edges.values():
+                ids.update(visit(child))
+            node.top = sorted(ids, key=rank)[:self.k]
+            return node.top
+        visit(self.root)
+
+        # Number nodes breadth first; labels of one node differ in their
+        # first character, so sorting by first character sorts the labels
+        nodes = [self.root]
+        edge_counts, labels, children, top_counts, top = [], [], [], [], []
+        for node in nodes:
+            edges = sorted(node.edges.items())
+            edge_counts.append(len(edges))
+            for _, (label, child) in edges:
+                labels.append(label)
+                children.append(len(nodes))
+                nodes.append(child)
+            top_counts.append(len(node.top))
+            top.extend(node.top)
+        self.edge_offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(edge_counts, out=self.edge_offsets[1:])
+        self.edge_labels = key_array(labels)
+        self.edge_children = np.array(children, dtype=np.int32)
+        self.top_offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(top_counts, out=self.top_offsets[1:])
+        self.top = np.array(top, dtype=np.int32)
+        self.root = None
+
+    def complete(self, prefix: str, limit: Optional[int] = None) -> List[int]:
+        """Best ids among keys starting with prefix"""
+        node = 0
+        while prefix:
+            start, stop = self.edge_offsets[node], self.edge_offsets[node + 1]
+            labels = self.edge_labels[start:stop]
+            at = int(np.searchsorted(labels, prefix[0].encode()))
+            if at == len(labels):
+                return []
+            label = labels[at].decode()
+            if label[0] != prefix[0]:
+                return []
+            if prefix.startswith(label):
+                prefix = prefix[len(label):]
+            elif label.startswith(prefix):
+                prefix = ""
+            else:
+                return []
+            node = int(self.edge_children[start + at])
+        return self.top[self.top_offsets[node]:self.top_offsets[node + 1]][:limit].tolist()
@@ -115,8 +115,11 @@ def install_dependencies():
     if not requirements_file.exists():
         print("📝 Creating requirements.txt...")
         with open(requirements_file, 'w') as f:
-            f.write("mcp>=1.0.0\n")
+            f.write("mcp>=1.10.0\n")
             f.write("typing-extensions>=4.0.0\n")
+            f.write("numpy>=1.21.0\n")
+            f.write("httpx>=0.24.0\n")
+            f.write("orjson>=3.6.0\n")
     
     try:
         # Upgrade pip first
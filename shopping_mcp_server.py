@@ -3,16 +3,33 @@
 MCP server for product search in popular UAE stores
 """
 
+import os
 import json
+import time
+import base64
 import asyncio
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 import random
 
+import anyio
+import numpy as np
 from mcp import Tool, server
 from mcp.server import Server
 from mcp.types import TextContent
 
+from cache import DiskCache, ResultCache, SingleFlight, normalize_arguments
+from catalog import AUTOCOMPLETE_LIMIT, SPEC_FILTERS, Catalog, Product
+from rendering import (
+    FORMATS, autocomplete_data, batch_data, comparison_data, encode, error_data, render_autocomplete, render_batch,
+    preview_best_offer, preview_offer, preview_products, render_comparison, render_search, render_store_info, search_data,
+    search_entry_sizes, store_info_data, take_within
+)
+from stores import (
+    SPECIAL_OFFERS, HttpStoreAdapter, ResilientStoreAdapter, StoreAdapter, StoreRouter, gather_offers,
+    mock_offer_columns, offer_seeds, stable_hash
+)
+
 # Create server instance
 app = Server("shopping-assistant")
 
@@ -616,54 +633,279 @@ MOCK_PRODUCTS = {
     ]
 }
 
-def generate_mock_offers(product: Dict[str, Any], query: str) -> List[Dict[str, Any]]:
+# Directory of a compiled catalog snapshot to load instead of indexing
+# MOCK_PRODUCTS; HTTP workers get one from serve_http()
+CATALOG_SNAPSHOT_ENV = "SHOPPING_MCP_CATALOG"
+
+# Indexes over MOCK_PRODUCTS, built once at startup. Spawned HTTP workers
+# run this script again as __mp_main__ before importing the module by name
+# to serve from it, so that first copy is never used and skips the catalog
+if __name__ == "__mp_main__":
+    CATALOG = None
+elif os.environ.get(CATALOG_SNAPSHOT_ENV):
+    CATALOG = Catalog.load(os.environ[CATALOG_SNAPSHOT_ENV])
+else:
+    CATALOG = Catalog(MOCK_PRODUCTS)
+
+# Category -> eligible stores, refreshed when stores are added
+STORE_ROUTER = StoreRouter(STORES)
+
+# Store backends by store id; see store_adapter()
+STORE_ADAPTERS: Dict[str, StoreAdapter] = {}
+
+# Tool results cache; offers and store details are mock data that should
+# still look fresh, so they expire sooner than search results
+RESULT_CACHE = ResultCache(
+    max_entries=1024,
+    ttl={
+        "search_products": 300,
+        "compare_prices": 60,
+        "compare_prices_batch": 60,
+        "autocomplete_products": 300,
+        "get_store_info": 600
+    }
+)
+
+# Persistent tier under RESULT_CACHE and OFFER_CACHE, shared by server
+# processes and kept across restarts. SHOPPING_MCP_CACHE sets the database
+# path; an empty value disables it.
+DISK_CACHE_PATH = os.environ.get(
+    "SHOPPING_MCP_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "shopping-mcp", "cache.sqlite3")
+)
+DISK_CACHE = DiskCache(DISK_CACHE_PATH, ttl=RESULT_CACHE.ttl) if DISK_CACHE_PATH else None
+
+# Environment variable carrying the HTTP bind host to worker processes
+HTTP_HOST_ENV = "SHOPPING_MCP_HTTP_HOST"
+
+# Bind hosts that only accept local connections
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+# Bump when tool output changes so persisted responses of older code are ignored
+RESPONSE_REVISION = 1
+
+# Mock offers are stable for this many seconds, then regenerate
+OFFER_WINDOW_SECONDS = 3600
+
+# Generated offers, one entry per product and time window
+OFFER_CACHE = ResultCache(max_entries=4096)
+
+# Tool calls currently being computed, for request coalescing
+IN_FLIGHT = SingleFlight()
+
+# Output format argument shared by every tool
+FORMAT_PROPERTY = {
+    "type": "string",
+    "description": "Response format: 'markdown' for reading, 'json' for structured results, 'compact' for columnar JSON with each field named once",
+    "enum": FORMATS,
+    "default": "markdown"
+}
+
+# Argument values equal to these defaults are dropped from cache keys
+TOOL_DEFAULTS = {
+    "search_products": {"category": "all", "min_rating": 0, "facets": False, "format": "markdown"},
+    "compare_prices": {"include_out_of_stock": False, "format": "markdown"},
+    "compare_prices_batch": {"include_out_of_stock": False, "format": "markdown"},
+    "autocomplete_products": {"limit": 5, "format": "markdown"},
+    "get_store_info": {"format": "markdown"}
+}
+
+# Number of best matches a search reports before its full response
+SEARCH_PREVIEW_SIZE = 3
+
+# Page size used when search_products gets a page number without page_size
+DEFAULT_PAGE_SIZE = 20
+
+# search_products arguments that pick a page of the results, not the results
+PAGINATION_ARGUMENTS = ("page", "page_size", "max_bytes", "cursor", "format")
+
+# Reports (progress, total, message) to the client while a tool call runs
+ProgressCallback = Callable[[float, Optional[float], str], Awaitable[None]]
+
+def reload_catalog():
+    """Rebuild the catalog indexes after MOCK_PRODUCTS changes"""
+    global CATALOG
+    CATALOG = Catalog(MOCK_PRODUCTS, version=CATALOG.version + 1)
+
+def resolve_product(product_name: str) -> Optional[Product]:
+    """Find a product by name, retrying once with typos corrected"""
+    product = CATALOG.resolve_name(product_name)
+    if not product:
+        corrected = CATALOG.correct(product_name)
+        if corrected:
+            product = CATALOG.resolve_name(corrected)
+    return product
+
+def disk_version() -> str:
+    """
+    Version of persisted entries: changes with the catalog data, the store
+    configuration and the response revision, but not across restarts
+    """
+    stores = stable_hash(json.dumps(STORES, sort_keys=True))
+    return f"{RESPONSE_REVISION}:{CATALOG.fingerprint}:{stores:016x}"
+
+def search_fingerprint(arguments: Dict[str, Any]) -> int:
+    """Hash of the search_products arguments that define the result set"""
+    selection = {key: value for key, value in arguments.items() if key not in PAGINATION_ARGUMENTS}
+    return stable_hash(normalize_arguments(selection, TOOL_DEFAULTS["search_products"]))
+
+def encode_cursor(arguments: Dict[str, Any], offset: int) -> str:
+    """Opaque cursor continuing a search after its first offset results"""
+    raw = f"{CATALOG.fingerprint}:{offset}:{search_fingerprint(arguments):x}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, arguments: Dict[str, Any]) -> Optional[int]:
+    """
+    Offset a cursor continues from, or None when it is malformed, was issued
+    for another search or for different catalog data
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        catalog, offset, fingerprint = raw.split(":")
+        offset, fingerprint = int(offset), int(fingerprint, 16)
+    except ValueError:
+        return None
+    if catalog != CATALOG.fingerprint or fingerprint != search_fingerprint(arguments) or offset < 0:
+        return None
+    return offset
+
+async def generate_mock_offers(product: Product, category: str, window: Optional[int] = None
+                               ) -> List[Dict[str, Any]]:
     """Generate mock offers from different stores"""
-    offers = []
+    return (await generate_mock_offers_batch([(product, category)], window))[0]
+
+async def generate_mock_offers_batch(items: List[Tuple[Product, str]],
+                               window: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Generate mock offers for many (product, category) pairs at once. Offers are
+    seeded per product, store and time window, so they stay the same for the
+    whole window and are served from the offer cache after the first call.
+    All uncached (product, store) pairs are drawn together as NumPy arrays.
+    """
+    now = time.time()
+    if window is None:
+        window = int(now // OFFER_WINDOW_SECONDS)
     
-    # Find product category
-    category = None
-    for cat, products in MOCK_PRODUCTS.items():
-        if product in products:
-            category = cat
-            break
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * len(items)
+    pending = []
+    for i, (product, category) in enumerate(items):
+        # Keyed by the eligible stores too, so a store added at runtime gets offers
+        store_ids = STORE_ROUTER.eligible_stores(category)
+        key = ("offers", f"{product.name}|{category}|{window}|{','.join(store_ids)}")
+        cached = OFFER_CACHE.get(key, CATALOG.version)
+        if cached is not None:
+            results[i] = list(cached)
+        else:
+            pending.append((i, product, key, store_ids))
     
-    # Select stores that can sell this category
-    eligible_stores = []
-    for store_id, store_info in STORES.items():
-        if category and category in store_info["categories"]:
-            eligible_stores.append((store_id, store_info))
+    # Offers another process or an earlier run already generated
+    if pending and DISK_CACHE:
+        stored = await DISK_CACHE.aget_many([key for _, _, key, _ in pending], disk_version())
+        for i, product, key, store_ids in pending:
+            if key in stored:
+                offers, ttl = stored[key]
+                OFFER_CACHE.put(key, CATALOG.version, offers, ttl=ttl)
+                results[i] = list(offers)
+        pending = [entry for entry in pending if entry[2] not in stored]
     
-    # Generate offers
-    for store_id, store_info in eligible_stores:
-        # Random price variation (±10%)
-        price_variation = random.uniform(0.9, 1.1)
-        price = round(product["price"] * price_variation, 2)
-        
-        # Random availability
-        in_stock = random.choice([True, True, True, False])  # 75% chance of being in stock
-        
-        # Random delivery time
-        delivery_days = random.randint(1, 7)
-        
-        offer = {
-            "store": store_info["name"],
-            "store_id": store_id,
-            "product_name": product["name"],
-            "price": price,
-            "currency": product["currency"],
-            "in_stock": in_stock,
-            "delivery_days": delivery_days,
-            "rating": round(random.uniform(4.0, 5.0), 1),
-            "reviews_count": random.randint(50, 5000),
-            "url": f"https://{store_id}.ae/product/{product['name'].lower().replace(' ', '-')}",
-            "special_offer": random.choice([None, "10% OFF", "Free Delivery", "Buy 1 Get 1", "Flash Sale", None, None])
-        }
-        offers.append(offer)
+    if pending:
+        # One row per (product, store) pair
+        pair_prices = []
+        pair_product_hashes = []
+        pair_store_hashes = []
+        for i, product, key, store_ids in pending:
+            for store_id in store_ids:
+                pair_prices.append(product.price)
+                pair_product_hashes.append(CATALOG.name_hash[product.id])
+                pair_store_hashes.append(STORE_ROUTER.store_hashes[store_id])
+        seeds = offer_seeds(
+            np.array(pair_product_hashes, dtype=np.uint64),
+            np.array(pair_store_hashes, dtype=np.uint64),
+            window
+        )
+        columns = mock_offer_columns(np.array(pair_prices, dtype=np.float64), seeds)
+        prices = columns["price"].tolist()
+        in_stock = columns["in_stock"].tolist()
+        delivery_days = columns["delivery_days"].tolist()
+        ratings = columns["rating"].tolist()
+        reviews_count = columns["reviews_count"].tolist()
+        special_offers = columns["special_offer"].tolist()
+        
+        row = 0
+        generated = []
+        for i, product, key, store_ids in pending:
+            offers = []
+            slug = product.name.lower().replace(' ', '-')
+            for store_id in store_ids:
+                offers.append({
+                    "store": STORES[store_id]["name"],
+                    "store_id": store_id,
+                    "product_name": product.name,
+                    "price": prices[row],
+                    "currency": product.currency,
+                    "in_stock": in_stock[row],
+                    "delivery_days": delivery_days[row],
+                    "rating": ratings[row],
+                    "reviews_count": reviews_count[row],
+                    "url": f"https://{store_id}.ae/product/{slug}",
+                    "special_offer": SPECIAL_OFFERS[special_offers[row]]
+                })
+                row += 1
+            
+            # Sort by price
+            offers.sort(key=lambda x: x["price"])
+            
+            # Keep the offers until their window closes
+            OFFER_CACHE.put(key, CATALOG.version, offers, ttl=(window + 1) * OFFER_WINDOW_SECONDS - now)
+            generated.append((key, offers))
+            results[i] = list(offers)
+        
+        if DISK_CACHE:
+            DISK_CACHE.put_many_nowait(generated, disk_version(), ttl=(window + 1) * OFFER_WINDOW_SECONDS - now)
     
-    # Sort by price
-    offers.sort(key=lambda x: x["price"])
+    return results
+
+class MockStoreAdapter(StoreAdapter):
+    """Default store backend serving the generated mock offers"""
     
-    return offers
+    async def get_offer(self, product: Product) -> Optional[Dict[str, Any]]:
+        for offer in await generate_mock_offers(product, product.category):
+            if offer["store_id"] == self.store_id:
+                return offer
+        return None
+
+def create_store_adapter(store_id: str, store_info: Dict[str, Any]) -> StoreAdapter:
+    """
+    HTTP adapter, behind a circuit breaker and stale-while-revalidate cache,
+    for stores with an api_url; the mock adapter otherwise
+    """
+    if store_info.get("api_url"):
+        return ResilientStoreAdapter(HttpStoreAdapter(store_id, store_info))
+    return MockStoreAdapter(store_id, store_info)
+
+def store_adapter(store_id: str) -> StoreAdapter:
+    """Adapter for a store, created on first use so runtime stores are covered"""
+    adapter = STORE_ADAPTERS.get(store_id)
+    if adapter is None:
+        adapter = STORE_ADAPTERS[store_id] = create_store_adapter(store_id, STORES[store_id])
+    return adapter
+
+async def open_store_adapters():
+    """Create the adapter of every store and open its connection pool"""
+    await asyncio.gather(*(store_adapter(store_id).open() for store_id in STORES))
+
+async def close_store_adapters():
+    """Close the connection pools of all store adapters"""
+    await asyncio.gather(*(adapter.close() for adapter in STORE_ADAPTERS.values()))
+
+async def fetch_offers(product: Product, on_offer: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+                       ) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Offers for product from every eligible store, queried concurrently, plus
+    the names of stores that did not answer in time. on_offer is awaited with
+    each offer as it arrives.
+    """
+    adapters = [store_adapter(store_id) for store_id in STORE_ROUTER.eligible_stores(product.category)]
+    return await gather_offers(adapters, product, on_offer)
 
 @app.list_tools()
 async def list_tools() -> List[Tool]:
@@ -693,7 +935,70 @@ async def list_tools() -> List[Tool]:
                         "description": "Minimum product rating (optional)",
                         "minimum": 0,
                         "maximum": 5
-                    }
+                    },
+                    "sort_by": {
+                        "type": "string",
+                        "description": "Sort results: 'relevance' for best match first, 'price' for cheapest first, 'rating' for best rated first (optional)",
+                        "enum": ["relevance", "price", "rating"]
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of products to return (optional)",
+                        "minimum": 1
+                    },
+                    "min_storage_gb": {
+                        "type": "number",
+                        "description": "Minimum storage in GB (optional)"
+                    },
+                    "min_ram_gb": {
+                        "type": "number",
+                        "description": "Minimum RAM in GB (optional)"
+                    },
+                    "min_display_inch": {
+                        "type": "number",
+                        "description": "Minimum display size in inches (optional)"
+                    },
+                    "max_display_inch": {
+                        "type": "number",
+                        "description": "Maximum display size in inches (optional)"
+                    },
+                    "min_battery_mah": {
+                        "type": "number",
+                        "description": "Minimum battery capacity in mAh (optional)"
+                    },
+                    "max_weight_kg": {
+                        "type": "number",
+                        "description": "Maximum weight in kg (optional)"
+                    },
+                    "color": {
+                        "type": "string",
+                        "description": "Product color, e.g. 'black' (optional)"
+                    },
+                    "facets": {
+                        "type": "boolean",
+                        "description": "Also return match counts per category, brand, price range and availability",
+                        "default": False
+                    },
+                    "page": {
+                        "type": "integer",
+                        "description": "Page of results to return, starting at 1 (optional)",
+                        "minimum": 1
+                    },
+                    "page_size": {
+                        "type": "integer",
+                        "description": f"Products per page (optional, {DEFAULT_PAGE_SIZE} when only page is given)",
+                        "minimum": 1
+                    },
+                    "max_bytes": {
+                        "type": "integer",
+                        "description": "Approximate size budget for the listed products in bytes; the rest is left for the next call (optional)",
+                        "minimum": 1
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "Continuation cursor from a previous response with the same search arguments (optional)"
+                    },
+                    "format": FORMAT_PROPERTY
                 },
                 "required": ["query"]
             }
@@ -712,11 +1017,56 @@ async def list_tools() -> List[Tool]:
                         "type": "boolean",
                         "description": "Include out-of-stock items",
                         "default": False
-                    }
+                    },
+                    "format": FORMAT_PROPERTY
                 },
                 "required": ["product_name"]
             }
         ),
+        Tool(
+            name="compare_prices_batch",
+            description="Compare prices for several products at once, e.g. a shopping list",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "product_names": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Product names to compare prices",
+                        "minItems": 1
+                    },
+                    "include_out_of_stock": {
+                        "type": "boolean",
+                        "description": "Include out-of-stock items",
+                        "default": False
+                    },
+                    "format": FORMAT_PROPERTY
+                },
+                "required": ["product_names"]
+            }
+        ),
+        Tool(
+            name="autocomplete_products",
+            description="Suggest product names starting with the given text",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "prefix": {
+                        "type": "string",
+                        "description": "Beginning of a product name or brand"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of suggestions",
+                        "minimum": 1,
+                        "maximum": AUTOCOMPLETE_LIMIT,
+                        "default": 5
+                    },
+                    "format": FORMAT_PROPERTY
+                },
+                "required": ["prefix"]
+            }
+        ),
         Tool(
             name="get_store_info",
             description="Get information about a specific store",
@@ -727,68 +1077,173 @@ async def list_tools() -> List[Tool]:
                         "type": "string",
                         "description": "Store name",
                         "enum": ["carrefour", "noon", "amazon_ae", "sharaf_dg", "lulu"]
-                    }
+                    },
+                    "format": FORMAT_PROPERTY
                 },
                 "required": ["store_name"]
             }
         )
     ]
 
+class PartialResponse(list):
+    """
+    Tool response missing the answers of some stores. It is served as is but
+    never cached, so a transient timeout is not replayed after the store recovers.
+    """
+
 @app.call_tool()
 async def call_tool(name: str, arguments: Any) -> List[TextContent]:
-    """Handle tool calls"""
+    """
+    Handle tool calls, serving repeated calls from the result cache and
+    coalescing identical concurrent calls
+    """
+    progress = progress_reporter()
+    if name not in TOOL_DEFAULTS:
+        return await handle_tool_call(name, arguments, progress)
+    
+    key = RESULT_CACHE.key(name, arguments, TOOL_DEFAULTS[name])
+    # Results go stale when the catalog is reloaded or a store is added
+    STORE_ROUTER.refresh()
+    version = (CATALOG.version, STORE_ROUTER.generation)
+    result = RESULT_CACHE.get(key, version)
+    if result is None:
+        async def compute() -> List[TextContent]:
+            # Responses persisted by another process or an earlier run
+            stored = await DISK_CACHE.aget(key, disk_version()) if DISK_CACHE else None
+            if stored is not None:
+                texts, ttl = stored
+                computed = [TextContent(type="text", text=text) for text in texts]
+                RESULT_CACHE.put(key, version, computed, ttl=ttl)
+                return computed
+            
+            computed = await handle_tool_call(name, arguments, progress)
+            if isinstance(computed, PartialResponse):
+                return computed
+            RESULT_CACHE.put(key, version, computed)
+            if DISK_CACHE:
+                DISK_CACHE.put_nowait(key, disk_version(), [content.text for content in computed])
+            return computed
+        
+        # Identical calls already in progress share one computation
+        result = await IN_FLIGHT.run((key, version), compute)
+    return list(result)
+
+def progress_reporter() -> Optional[ProgressCallback]:
+    """
+    Progress callback for the current request, or None when the client did not
+    ask for progress. Coalesced calls only report to the caller that started
+    the computation.
+    """
+    try:
+        context = app.request_context
+    except LookupError:
+        return None
+    token = context.meta.progressToken if context.meta else None
+    if token is None:
+        return None
+    
+    async def report(progress: float, total: Optional[float], message: str):
+        try:
+            await context.session.send_progress_notification(
+                token, progress, total=total, message=message, related_request_id=str(context.request_id)
+            )
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            # Progress is best effort; the final response still carries everything
+            pass
+    
+    return report
+
+def message_response(text: str, output_format: str) -> List[TextContent]:
+    """Plain message result, wrapped as an error object in the JSON formats"""
+    if output_format != "markdown":
+        text = encode(error_data(text))
+    return [TextContent(type="text", text=text)]
+
+async def handle_tool_call(name: str, arguments: Any, progress: Optional[ProgressCallback] = None) -> List[TextContent]:
+    """
+    Compute the result of a tool call. Long-running tools send early partial
+    results through progress: the best search matches, and store offers as
+    the stores answer.
+    """
+    output_format = arguments.get("format", "markdown")
+    compact = output_format == "compact"
     
     if name == "search_products":
         query = arguments.get("query", "")
         category = arguments.get("category", "all")
         max_price = arguments.get("max_price")
         min_rating = arguments.get("min_rating", 0)
+        sort_by = arguments.get("sort_by")
+        limit = arguments.get("limit")
+        include_facets = arguments.get("facets", False)
+        specs = {key: arguments[key] for key in [*SPEC_FILTERS, "color"] if arguments.get(key) is not None}
+        page = arguments.get("page")
+        page_size = arguments.get("page_size")
+        max_bytes = arguments.get("max_bytes")
+        cursor = arguments.get("cursor")
         
-        results = []
-        
-        # Search in all categories or specific one
-        categories_to_search = MOCK_PRODUCTS.keys() if category == "all" else [category]
-        
-        for cat in categories_to_search:
-            if cat in MOCK_PRODUCTS:
-                for product in MOCK_PRODUCTS[cat]:
-                    # Simple search by name and brand
-                    if (query.lower() in product["name"].lower() or 
-                        query.lower() in product.get("brand", "").lower()):
-                        
-                        # Filter by price and rating
-                        if max_price and product["price"] > max_price:
-                            continue
-                        if product.get("rating", 0) < min_rating:
-                            continue
-                            
-                        results.append({
-                            "category": cat,
-                            **product
-                        })
-        
-        if not results:
+        if page and not page_size:
+            page_size = DEFAULT_PAGE_SIZE
+        
+        offset = 0
+        if cursor:
+            offset = decode_cursor(cursor, arguments)
+            if offset is None:
+                return message_response(
+                    "This cursor has expired or belongs to a different search. "
+                    "Please repeat the search without a cursor.", output_format
+                )
+        elif page:
+            offset = (page - 1) * page_size
+        
+        # Only the results up to the end of the page are ranked, plus one
+        # more to tell whether another page follows
+        fetch_limit = limit
+        if page_size:
+            fetch_limit = offset + page_size + 1 if limit is None else min(limit, offset + page_size + 1)
+        
+        # Search by name and brand, filtering by price and rating
+        product_ids = CATALOG.search(query, category, max_price, min_rating, sort_by, fetch_limit, specs)
+        
+        # Retry once with typos corrected instead of making the client guess,
+        # but only when the text itself matches nothing; an empty result
+        # caused by the filters is not a typo
+        corrected = None
+        if not product_ids and not CATALOG.search(query, limit=1):
+            corrected = CATALOG.correct(query)
+            if corrected:
+                product_ids = CATALOG.search(corrected, category, max_price, min_rating, sort_by, fetch_limit, specs)
+        
+        end = offset + page_size if page_size else len(product_ids)
+        results = [CATALOG.products[product_id] for product_id in product_ids[offset:end]]
+        has_more = len(product_ids) > end
+        
+        # Stop at the size budget; the cursor picks up from the first product left out
+        if max_bytes and results:
+            count = take_within(search_entry_sizes(results, offset + 1, output_format), max_bytes)
+            has_more = has_more or count < len(results)
+            results = results[:count]
+        next_cursor = encode_cursor(arguments, offset + len(results)) if has_more else None
+        
+        if not results and output_format == "markdown":
             return [TextContent(
                 type="text",
                 text=f"Sorry, no products found for query '{query}'. Try adjusting your search parameters."
             )]
         
-        # Format results
-        response = f"Found {len(results)} products:\n\n"
+        # The best matches go out as soon as the page is known, ahead of facet
+        # counting and rendering; no total, as nothing else is reported before the response
+        if progress and results:
+            await progress(1, None, preview_products(results[:SEARCH_PREVIEW_SIZE], output_format))
         
-        for i, product in enumerate(results, 1):
-            response += f"{i}. **{product['name']}**\n"
-            response += f"   Brand: {product.get('brand', 'N/A')}\n"
-            response += f"   Price: {product['price']} {product['currency']}\n"
-            response += f"   Rating: ⭐ {product.get('rating', 'N/A')}\n"
-            response += f"   In Stock: {'✅ Yes' if product.get('in_stock') else '❌ No'}\n"
-            response += f"   Category: {product['category'].title()}\n"
-            
-            if product.get('specs'):
-                response += "   Specifications:\n"
-                for key, value in product['specs'].items():
-                    response += f"     • {key.replace('_', ' ').title()}: {value}\n"
-            response += "\n"
+        facets = None
+        if include_facets:
+            facets = CATALOG.facets(corrected or query, category, max_price, min_rating, specs)
+        
+        if output_format == "markdown":
+            response = render_search(results, query, corrected, facets, offset + 1, next_cursor)
+        else:
+            response = encode(search_data(results, query, corrected, facets, compact, offset, next_cursor))
         
         return [TextContent(type="text", text=response)]
     
@@ -797,99 +1252,232 @@ async def call_tool(name: str, arguments: Any) -> List[TextContent]:
         include_out_of_stock = arguments.get("include_out_of_stock", False)
         
         # Find product
-        found_product = None
-        for category, products in MOCK_PRODUCTS.items():
-            for product in products:
-                if product_name.lower() in product["name"].lower():
-                    found_product = product
-                    break
-            if found_product:
-                break
+        found_product = resolve_product(product_name)
         
         if not found_product:
-            return [TextContent(
-                type="text",
-                text=f"Product '{product_name}' not found. Please try a different product name."
-            )]
+            return message_response(
+                f"Product '{product_name}' not found. Please try a different product name.", output_format
+            )
+        
+        # Query all stores at once; slow stores are reported, not awaited,
+        # and each offer is passed on as soon as its store answers
+        on_offer = None
+        if progress:
+            store_count = len(STORE_ROUTER.eligible_stores(found_product.category))
+            received = []
+            
+            async def on_offer(offer: Dict[str, Any]):
+                received.append(offer)
+                await progress(len(received), store_count, preview_offer(offer, output_format))
         
-        # Generate offers from different stores
-        offers = generate_mock_offers(found_product, product_name)
+        offers, unavailable = await fetch_offers(found_product, on_offer)
         
         # Filter by availability if needed
         if not include_out_of_stock:
             offers = [o for o in offers if o["in_stock"]]
         
-        # Format response
-        response = f"**Price Comparison for {found_product['name']}**\n\n"
+        if output_format == "markdown":
+            response = render_comparison(found_product, offers, unavailable)
+        else:
+            response = encode(comparison_data(found_product, offers, unavailable, compact))
+        
+        if unavailable:
+            return PartialResponse([TextContent(type="text", text=response)])
+        return [TextContent(type="text", text=response)]
+    
+    elif name == "compare_prices_batch":
+        product_names = arguments.get("product_names", [])
+        include_out_of_stock = arguments.get("include_out_of_stock", False)
         
-        if not offers:
-            response += "Sorry, this product is temporarily out of stock in all stores."
+        # Resolve every name, then generate all store offers in one pass
+        found = []
+        not_found = []
+        for product_name in product_names:
+            product = resolve_product(product_name)
+            if product:
+                found.append(product)
+            else:
+                not_found.append(product_name)
+        
+        # Generate the mock offers in one pass, then query all stores for
+        # all products concurrently
+        await generate_mock_offers_batch([(p, p.category) for p in found])
+        completed = []
+        
+        async def fetch(product: Product) -> Tuple[List[Dict[str, Any]], List[str]]:
+            # Each product's best offer is passed on once all its stores answered
+            offers, stores = await fetch_offers(product)
+            completed.append(product)
+            in_stock = [o for o in offers if o["in_stock"]] if not include_out_of_stock else offers
+            if progress and in_stock:
+                await progress(len(completed), len(found), preview_best_offer(product, in_stock[0], output_format))
+            return offers, stores
+        
+        fetched = await asyncio.gather(*(fetch(p) for p in found))
+        offers_per_product = [offers for offers, _ in fetched]
+        unavailable = sorted({store for _, stores in fetched for store in stores})
+        
+        if not include_out_of_stock:
+            offers_per_product = [[o for o in offers if o["in_stock"]] for offers in offers_per_product]
+        
+        if output_format == "markdown":
+            response = render_batch(found, offers_per_product, not_found, unavailable)
         else:
-            response += f"Found {len(offers)} offers:\n\n"
-            
-            best_price = offers[0]
-            response += f"🏆 **Best Price: {best_price['store']} - {best_price['price']} {best_price['currency']}**\n\n"
-            
-            response += "All offers:\n\n"
-            for i, offer in enumerate(offers, 1):
-                response += f"{i}. **{offer['store']}**\n"
-                response += f"   Price: {offer['price']} {offer['currency']}"
-                
-                if offer.get('special_offer'):
-                    response += f" 🔥 {offer['special_offer']}"
-                response += "\n"
-                
-                response += f"   In Stock: {'✅' if offer['in_stock'] else '❌'}\n"
-                response += f"   Delivery: {offer['delivery_days']} days\n"
-                response += f"   Rating: ⭐ {offer['rating']} ({offer['reviews_count']} reviews)\n"
-                response += f"   Link: {offer['url']}\n\n"
+            response = encode(batch_data(found, offers_per_product, not_found, unavailable, compact))
         
+        if unavailable:
+            return PartialResponse([TextContent(type="text", text=response)])
         return [TextContent(type="text", text=response)]
     
-    elif name == "get_store_info":
-        store_name = arguments.get("store_name", "")
+    elif name == "autocomplete_products":
+        prefix = arguments.get("prefix", "")
+        limit = arguments.get("limit", 5)
         
-        if store_name not in STORES:
+        completions = [CATALOG.products[product_id] for product_id in CATALOG.complete(prefix, limit)]
+        
+        if not completions and output_format == "markdown":
             return [TextContent(
                 type="text",
-                text=f"Store '{store_name}' not found. Available stores: {', '.join(STORES.keys())}"
+                text=f"No products start with '{prefix}'."
             )]
         
-        store = STORES[store_name]
+        if output_format == "markdown":
+            response = render_autocomplete(prefix, completions)
+        else:
+            response = encode(autocomplete_data(prefix, completions, compact))
+        
+        return [TextContent(type="text", text=response)]
+    
+    elif name == "get_store_info":
+        store_name = arguments.get("store_name", "")
+        
+        if store_name not in STORES:
+            return message_response(
+                f"Store '{store_name}' not found. Available stores: {', '.join(STORES.keys())}", output_format
+            )
         
-        response = f"**{store['name']} Store Information**\n\n"
-        response += f"Product Categories:\n"
-        for cat in store['categories']:
-            response += f"• {cat.replace('_', ' ').title()}\n"
+        store = STORES[store_name]
         
         # Add additional mock information
-        response += f"\n📍 Number of locations in UAE: {random.randint(10, 50)}\n"
-        response += f"🚚 Free delivery from: {random.randint(50, 150)} AED\n"
-        response += f"💳 Payment methods: Cards, Cash, Apple Pay, Samsung Pay\n"
-        response += f"📞 Customer service: 800-{random.randint(10000, 99999)}\n"
-        response += f"🌐 Website: https://{store_name}.ae\n"
-        response += f"⏰ Operating hours: 9 AM - 12 AM\n"
-        response += f"🛍️ Online shopping: Available\n"
-        response += f"📱 Mobile app: Available on iOS & Android\n"
+        details = dict(
+            locations=random.randint(10, 50),
+            free_delivery_from=random.randint(50, 150),
+            phone=random.randint(10000, 99999),
+        )
+        if output_format == "markdown":
+            response = render_store_info(store_name, store, **details)
+        else:
+            response = encode(store_info_data(store_name, store, **details))
         
         return [TextContent(type="text", text=response)]
     
     else:
-        return [TextContent(
-            type="text",
-            text=f"Unknown tool: {name}"
-        )]
+        return message_response(f"Unknown tool: {name}", output_format)
 
-async def main():
-    """Start MCP server"""
+async def serve_stdio():
+    """Serve one client over stdin/stdout"""
     from mcp.server.stdio import stdio_server
     
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            app.create_initialization_options()
+    # One pooled client per store backend for the whole session
+    await open_store_adapters()
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await app.run(
+                read_stream,
+                write_stream,
+                app.create_initialization_options()
+            )
+    finally:
+        await close_store_adapters()
+        if DISK_CACHE:
+            await DISK_CACHE.aclose()
+
+class StreamableHTTPEndpoint:
+    """ASGI endpoint handing /mcp requests to the session manager"""
+    
+    def __init__(self, session_manager):
+        self.session_manager = session_manager
+    
+    async def __call__(self, scope, receive, send):
+        await self.session_manager.handle_request(scope, receive, send)
+
+def create_http_app():
+    """
+    ASGI app serving the tools over streamable HTTP (JSON or SSE responses)
+    at /mcp. Sessions are stateless, so any worker can answer any request.
+    """
+    import contextlib
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from mcp.server.transport_security import TransportSecuritySettings
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+    
+    # Guard local servers against DNS rebinding; other hosts are expected to
+    # sit behind a proxy that checks Host and Origin itself
+    security = None
+    if os.environ.get(HTTP_HOST_ENV, "127.0.0.1") in LOOPBACK_HOSTS:
+        security = TransportSecuritySettings(
+            enable_dns_rebinding_protection=True,
+            allowed_hosts=["127.0.0.1:*", "localhost:*", "[::1]:*"],
+            allowed_origins=["http://127.0.0.1:*", "http://localhost:*", "http://[::1]:*"]
         )
+    session_manager = StreamableHTTPSessionManager(app=app, stateless=True, security_settings=security)
+    
+    @contextlib.asynccontextmanager
+    async def lifespan(_):
+        await open_store_adapters()
+        try:
+            async with session_manager.run():
+                yield
+        finally:
+            await close_store_adapters()
+            if DISK_CACHE:
+                await DISK_CACHE.aclose()
+    
+    return Starlette(routes=[Route("/mcp", endpoint=StreamableHTTPEndpoint(session_manager))], lifespan=lifespan)
+
+def serve_http(host: str, port: int, workers: int = 1):
+    """
+    Serve over streamable HTTP. With several workers, uvicorn runs that many
+    processes on one port. The catalog compiled here is saved as a snapshot
+    that every worker loads instead of indexing the products again. Its
+    columns and compiled text indexes are memory-mapped, so all workers share
+    one copy; only the product records are loaded into each worker.
+    """
+    import shutil
+    import tempfile
+    import uvicorn
+    
+    # Workers only receive the import string, so the bind host and the
+    # snapshot reach them through the environment
+    os.environ[HTTP_HOST_ENV] = host
+    if workers > 1:
+        snapshot = tempfile.mkdtemp(prefix="shopping-mcp-catalog-")
+        try:
+            CATALOG.save(snapshot)
+            os.environ[CATALOG_SNAPSHOT_ENV] = snapshot
+            uvicorn.run("shopping_mcp_server:create_http_app", factory=True, host=host, port=port, workers=workers)
+        finally:
+            shutil.rmtree(snapshot, ignore_errors=True)
+    else:
+        uvicorn.run(create_http_app(), host=host, port=port)
+
+def main():
+    """Start MCP server"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--transport", choices=["stdio", "http"], default="stdio",
+                        help="stdio for a single desktop client, http for a shared server (default: stdio)")
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="HTTP port (default: 8000)")
+    parser.add_argument("--workers", type=int, default=1, help="HTTP worker processes (default: 1)")
+    args = parser.parse_args()
+    
+    if args.transport == "http":
+        serve_http(args.host, args.port, args.workers)
+    else:
+        asyncio.run(serve_stdio())
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    main()
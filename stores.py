@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Store routing, store adapters and vectorized mock offer generation
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import httpx
+import numpy as np
+
+# Special offers drawn for mock offers; None means no promotion
+SPECIAL_OFFERS = [None, "10% OFF", "Free Delivery", "Buy 1 Get 1", "Flash Sale", None, None]
+
+# Seconds to wait for a store before answering without its offer
+STORE_TIMEOUT_SECONDS = 2.0
+
+# Connection pool settings of the HTTP store clients
+MAX_CONNECTIONS_PER_STORE = 10
+KEEPALIVE_EXPIRY_SECONDS = 30.0
+
+# Circuit breaker defaults: trip when at least BREAKER_MIN_REQUESTS of the last
+# BREAKER_WINDOW calls were made and BREAKER_ERROR_RATE of them failed, then
+# retry with a single trial call after BREAKER_RESET_SECONDS
+BREAKER_WINDOW = 20
+BREAKER_MIN_REQUESTS = 5
+BREAKER_ERROR_RATE = 0.5
+BREAKER_RESET_SECONDS = 30.0
+
+# Offer fields accepted from store backends: field -> (types, required).
+# Anything else in a backend payload is dropped.
+OFFER_SCHEMA = {
+    "price": ((int, float), True),
+    "currency": ((str,), True),
+    "in_stock": ((bool,), True),
+    "delivery_days": ((int,), False),
+    "rating": ((int, float), False),
+    "reviews_count": ((int,), False),
+    "url": ((str,), False),
+    "special_offer": ((str,), False),
+}
+
+# Offers younger than this are served without a refresh
+OFFER_FRESH_SECONDS = 60.0
+
+# Offers older than this are dropped instead of served while the store is down
+OFFER_MAX_STALE_SECONDS = 900.0
+
+# Offers kept per store for stale-while-revalidate
+STALE_OFFERS_PER_STORE = 1024
+
+# SplitMix64 constants
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def stable_hash(text: str) -> int:
+    """64-bit hash of text that is identical across processes and restarts"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _mix(z: np.ndarray) -> np.ndarray:
+    """SplitMix64 output function"""
+    z = (z ^ (z >> np.uint64(30))) * _MIX_1
+    z = (z ^ (z >> np.uint64(27))) * _MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+def uniforms(seeds: np.ndarray, count: int) -> np.ndarray:
+    """
+    count uniform floats in [0, 1) per seed, shape (count, len(seeds)). Each
+    seed drives its own SplitMix64 stream, so the values for a seed do not
+    depend on which other seeds are generated alongside it.
+    """
+    state = seeds.astype(np.uint64)
+    draws = np.empty((count, len(state)))
+    for k in range(count):
+        state = state + _GOLDEN_GAMMA
+        draws[k] = (_mix(state) >> np.uint64(11)) * (1.0 / (1 << 53))
+    return draws
+
+
+def offer_seeds(product_hashes: np.ndarray, store_hashes: np.ndarray, window: int) -> np.ndarray:
+    """Seed for every (product, store, time window) pair"""
+    window_hash = np.uint64(stable_hash(str(window)))
+    return _mix(product_hashes.astype(np.uint64) ^ _mix(store_hashes.astype(np.uint64) ^ window_hash))
+
+
+def mock_offer_columns(prices: np.ndarray, seeds: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Mock offer fields for many (product, store) pairs at once: ±10% price
+    variation, 75% availability, 1-7 delivery days, 4.0-5.0 store rating,
+    50-5000 reviews and an optional special offer index into SPECIAL_OFFERS.
+    """
+    draws = uniforms(seeds, 6)
+    return {
+        "price": np.round(prices * (0.9 + 0.2 * draws[0]), 2),
+        "in_stock": draws[1] < 0.75,
+        "delivery_days": 1 + (draws[2] * 7).astype(np.int64),
+        "rating": np.round(4.0 + draws[3], 1),
+        "reviews_count": 50 + (draws[4] * 4951).astype(np.int64),
+        "special_offer": (draws[5] * len(SPECIAL_OFFERS)).astype(np.int64),
+    }
+
+
+class StoreRouter:
+    """
+    Routing table from product category to the ids of the stores selling it,
+    in STORES order. Rebuilt whenever a store is added; generation counts
+    the rebuilds, so results derived from the routes can be keyed by it.
+    """
+
+    def __init__(self, stores: Dict[str, Dict[str, Any]]):
+        self.stores = stores
+        self.routes: Dict[str, Tuple[str, ...]] = {}
+        self.store_hashes: Dict[str, int] = {}
+        self.size = 0
+        self.generation = 0
+        self.rebuild()
+
+    def rebuild(self):
+        """Recompute the routing table from the store definitions"""
+        routes: Dict[str, list] = {}
+        for store_id, store_info in self.stores.items():
+            for category in store_info["categories"]:
+                routes.setdefault(category, []).append(store_id)
+        self.routes = {category: tuple(store_ids) for category, store_ids in routes.items()}
+        self.store_hashes = {store_id: stable_hash(store_id) for store_id in self.stores}
+        self.size = len(self.stores)
+        self.generation += 1
+
+    def add_store(self, store_id: str, store_info: Dict[str, Any]):
+        """Register a store at runtime and refresh the routing table"""
+        self.stores[store_id] = store_info
+        self.rebuild()
+
+    def refresh(self):
+        """Pick up stores added straight to the dict"""
+        if len(self.stores) != self.size:
+            self.rebuild()
+
+    def eligible_stores(self, category: str) -> Tuple[str, ...]:
+        """Ids of the stores selling category"""
+        self.refresh()
+        return self.routes.get(category, ())
+
+
+class StoreAdapter:
+    """
+    Source of offers for one store. Subclasses implement get_offer; the
+    default store backend is the mock generator in shopping_mcp_server.
+    """
+
+    def __init__(self, store_id: str, store_info: Dict[str, Any]):
+        self.store_id = store_id
+        self.store_info = store_info
+        self.timeout = store_info.get("timeout", STORE_TIMEOUT_SECONDS)
+
+    async def open(self):
+        """Acquire long-lived resources such as connection pools"""
+
+    async def close(self):
+        """Release the resources acquired by open"""
+
+    async def get_offer(self, product: Any) -> Optional[Dict[str, Any]]:
+        """Offer for product from this store, or None if the store does not sell it"""
+        raise NotImplementedError
+
+
+class InvalidOffer(ValueError):
+    """Raised when a store backend answers with a malformed offer"""
+
+
+def normalize_offer(payload: Any, store_id: str, store_name: str, product_name: str) -> Dict[str, Any]:
+    """
+    Offer dict built from a backend payload: required fields checked, optional
+    ones set to None when missing, unknown keys dropped. Raises InvalidOffer.
+    """
+    if not isinstance(payload, dict):
+        raise InvalidOffer(f"{store_id}: offer is not a JSON object")
+    offer = {"store": store_name, "store_id": store_id, "product_name": product_name}
+    for field, (types, required) in OFFER_SCHEMA.items():
+        value = payload.get(field)
+        if value is None:
+            if required:
+                raise InvalidOffer(f"{store_id}: offer has no {field}")
+        elif not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            raise InvalidOffer(f"{store_id}: offer {field} has the wrong type")
+        offer[field] = value
+    if not math.isfinite(offer["price"]) or offer["price"] < 0:
+        raise InvalidOffer(f"{store_id}: offer price is not a valid amount")
+    return offer
+
+
+class HttpStoreAdapter(StoreAdapter):
+    """
+    Store backend reachable over HTTP. GET {api_url}/offers?product=<name>
+    returns the offer as a JSON object, or 404 when the product is not sold.
+    Malformed offers raise InvalidOffer, so the store counts as unavailable.
+
+    Between open() and close() requests share one pooled keep-alive client;
+    store_info may set max_connections and http2 (needs the h2 package).
+    """
+
+    def __init__(self, store_id: str, store_info: Dict[str, Any]):
+        super().__init__(store_id, store_info)
+        self.api_url = store_info["api_url"].rstrip("/")
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def create_client(self) -> httpx.AsyncClient:
+        """Client with a per-host connection limit and keep-alive"""
+        max_connections = self.store_info.get("max_connections", MAX_CONNECTIONS_PER_STORE)
+        options = dict(
+            base_url=self.api_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+            )
+        )
+        if self.store_info.get("http2"):
+            try:
+                return httpx.AsyncClient(http2=True, **options)
+            except ImportError:
+                # h2 is not installed; HTTP/1.1 keep-alive still pools connections
+                pass
+        return httpx.AsyncClient(**options)
+
+    async def open(self):
+        if self.client is None:
+            self.client = self.create_client()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get_offer(self, product: Any) -> Optional[Dict[str, Any]]:
+        params = {"product": product.name}
+        if self.client is not None:
+            response = await self.client.get("/offers", params=params)
+        else:
+            # Not opened: a one-off connection, as used by scripts and tests
+            async with self.create_client() as client:
+                response = await client.get("/offers", params=params)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return normalize_offer(response.json(), self.store_id, self.store_info["name"], product.name)
+
+
+class StoreUnavailable(Exception):
+    """Raised instead of calling a store whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker driven by the error rate over the
+    last calls. While open, calls fail fast; after the reset timeout a single
+    trial call decides whether to close again or stay open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_requests: int = BREAKER_MIN_REQUESTS,
+                 error_rate: float = BREAKER_ERROR_RATE, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.reset_timeout = reset_timeout
+        self.outcomes: deque = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Whether a call may go to the store now"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        """Register a successful call"""
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+            self.outcomes.clear()
+        self.outcomes.append(True)
+
+    def record_failure(self):
+        """Register a failed call, opening the breaker when errors dominate"""
+        if self.state == self.HALF_OPEN:
+            self.trip()
+            return
+        self.outcomes.append(False)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.error_rate:
+            self.trip()
+
+    def record_cancelled(self):
+        """Forget a call cancelled by its caller; it says nothing about the store"""
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = False
+
+    def trip(self):
+        """Open the breaker"""
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+
+
+class ResilientStoreAdapter(StoreAdapter):
+    """
+    Wraps a store adapter with a circuit breaker and a stale-while-revalidate
+    offer cache: a known offer is returned at once and, when older than
+    fresh_seconds, refreshed in the background. Offers older than
+    max_stale_seconds are dropped, so a store that stays down eventually
+    reports as unavailable. Only products without a usable offer wait for
+    the store, bounded by its timeout.
+    """
+
+    def __init__(self, inner: StoreAdapter, breaker: Optional[CircuitBreaker] = None,
+                 fresh_seconds: float = OFFER_FRESH_SECONDS, max_entries: int = STALE_OFFERS_PER_STORE,
+                 max_stale_seconds: float = OFFER_MAX_STALE_SECONDS):
+        super().__init__(inner.store_id, inner.store_info)
+        self.inner = inner
+        self.breaker = breaker or CircuitBreaker()
+        self.fresh_seconds = fresh_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.max_entries = max_entries
+        self.offers: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self.refreshing: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        # The inner call is bounded here so that timeouts count as failures
+        self.inner_timeout = self.timeout
+        self.timeout = None
+
+    async def open(self):
+        await self.inner.open()
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await self.inner.close()
+
+    async def get_offer(self, product: Any) -> Optional[Dict[str, Any]]:
+        entry = self.offers.get(product.name)
+        if entry is not None and time.monotonic() - entry[0] > self.max_stale_seconds:
+            del self.offers[product.name]
+            entry = None
+        if entry is None:
+            return await self.fetch(product)
+
+        fetched_at, offer = entry
+        self.offers.move_to_end(product.name)
+        if time.monotonic() - fetched_at > self.fresh_seconds and product.name not in self.refreshing:
+            self.refreshing.add(product.name)
+            task = asyncio.ensure_future(self.refresh(product))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return offer
+
+    async def fetch(self, product: Any) -> Optional[Dict[str, Any]]:
+        """Call the store through the breaker and remember the answer"""
+        if not self.breaker.allow():
+            raise StoreUnavailable(self.store_id)
+        try:
+            offer = await asyncio.wait_for(self.inner.get_offer(product), self.inner_timeout)
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except Exception:
+            # Errors and timeouts of the store itself
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        self.offers[product.name] = (time.monotonic(), offer)
+        self.offers.move_to_end(product.name)
+        while len(self.offers) > self.max_entries:
+            self.offers.popitem(last=False)
+        return offer
+
+    async def refresh(self, product: Any):
+        """Background refresh; on failure the stale offer keeps being served"""
+        try:
+            await self.fetch(product)
+        except Exception:
+            pass
+        finally:
+            self.refreshing.discard(product.name)
+
+
+async def gather_offers(adapters: Sequence[StoreAdapter], product: Any,
+                        on_offer: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+                        ) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Query every adapter concurrently, each bounded by its own timeout. Returns
+    the offers sorted by price and the names of the stores that failed or
+    timed out, so a slow store only drops its own offer. on_offer is awaited
+    with each offer as soon as its store answers.
+    """
+    async def fetch(adapter: StoreAdapter):
+        try:
+            offer = await asyncio.wait_for(adapter.get_offer(product), adapter.timeout)
+        except Exception as e:
+            return e
+        if offer is not None and on_offer is not None:
+            await on_offer(offer)
+        return offer
+
+    results = await asyncio.gather(*(fetch(adapter) for adapter in adapters))
+
+    offers = []
+    unavailable = []
+    for adapter, result in zip(adapters, results):
+        if isinstance(result, Exception):
+            unavailable.append(adapter.store_info["name"])
+        elif result is not None:
+            offers.append(result)
+    offers.sort(key=lambda x: x["price"])
+    return offers, unavailable
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Local stub store backend for the tests and the store client benchmark
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class StubStoreHandler(BaseHTTPRequestHandler):
+    """
+    Stub store backend: /<store_id>/offers?product=<name>; the 'slow' store
+    never answers in time and the 'broken' store leaves out required fields
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        store_id = url.path.strip("/").split("/")[0]
+        product = parse_qs(url.query).get("product", [""])[0]
+        if store_id == "slow":
+            time.sleep(1)
+        payload = {
+            "price": 999.0,
+            "currency": "AED",
+            "in_stock": True,
+            "delivery_days": 1,
+            "rating": 4.9,
+            "reviews_count": 10,
+            "url": f"http://stub/{store_id}/{product}",
+            "special_offer": None
+        }
+        if store_id == "broken":
+            payload = {"price": 10.0, "currency": "AED"}
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and closed the connection
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_store() -> Tuple[ThreadingHTTPServer, str]:
+    """Serve StubStoreHandler on a free local port; returns the server and its base URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStoreHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -5,7 +5,23 @@ Test script to verify MCP server functionality
 
 import asyncio
 import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Keep the server's disk cache out of the user's ~/.cache and fresh on every run
+CACHE_DIRECTORY = tempfile.TemporaryDirectory()
+os.environ["SHOPPING_MCP_CACHE"] = os.path.join(CACHE_DIRECTORY.name, "cache.sqlite3")
+
+import shopping_mcp_server
+from cache import DiskCache, ResultCache
+from catalog import Catalog
+from rendering import batch_data, render_batch
 from shopping_mcp_server import app, call_tool
+from stores import CircuitBreaker, HttpStoreAdapter, ResilientStoreAdapter, StoreAdapter
+from stub_store import start_stub_store
 
 async def test_search_products():
     """Test product search functionality"""
@@ -44,6 +60,55 @@ async def test_search_products():
     print("Search for 'Nike' in clothing:")
     print(result[0].text)
     print()
+    
+    # Test 5: Top-k by price
+    result = await call_tool("search_products", {
+        "query": "",
+        "category": "electronics",
+        "sort_by": "price",
+        "limit": 3
+    })
+    print("3 cheapest electronics:")
+    print(result[0].text)
+    print()
+    
+    # Test 6: Misspelled query
+    result = await call_tool("search_products", {"query": "iphnoe"})
+    print("Search for misspelled 'iphnoe':")
+    print(result[0].text)
+    print()
+    
+    # Filters that exclude every match are not a typo
+    result = await call_tool("search_products", {"query": "e", "category": "clothing", "min_rating": 4.7})
+    print("Search for 'e' in clothing rated 4.7+ (no correction expected):")
+    print(result[0].text)
+    print()
+    
+    # Test 7: Facet counts
+    result = await call_tool("search_products", {
+        "query": "",
+        "category": "all",
+        "limit": 1,
+        "facets": True
+    })
+    print("Facets for the whole catalog:")
+    print(result[0].text)
+    print()
+    
+    # Test 8: Spec filters
+    result = await call_tool("search_products", {
+        "query": "",
+        "min_storage_gb": 512,
+        "color": "black"
+    })
+    print("Products with 512GB+ storage in black:")
+    print(result[0].text)
+    print()
+    
+    result = await call_tool("search_products", {"query": "", "max_weight_kg": 2})
+    print("Products weighing at most 2 kg:")
+    print(result[0].text)
+    print()
 
 async def test_compare_prices():
     """Test price comparison functionality"""
@@ -65,6 +130,346 @@ async def test_compare_prices():
     print(result[0].text)
     print()
 
+async def test_compare_prices_batch():
+    """Test batch price comparison functionality"""
+    print("=== Test: Batch Price Comparison ===")
+    
+    # Compare prices for a shopping list
+    result = await call_tool("compare_prices_batch", {
+        "product_names": ["iPhone 15 Pro Max", "Basmati Rice", "playstaton", "Unknown Gadget"]
+    })
+    print("Price comparison for a shopping list:")
+    print(result[0].text)
+    print()
+    
+    # The total counts the cheapest offer in stock, not the cheapest offer
+    product = shopping_mcp_server.CATALOG.products[0]
+    offers = [
+        {"store": "A", "price": 90.0, "currency": "AED", "in_stock": False},
+        {"store": "B", "price": 100.0, "currency": "AED", "in_stock": True},
+    ]
+    text = render_batch([product], [offers], [], [])
+    print(f"Total with the cheapest offer out of stock: {text.splitlines()[-1]}, "
+          f"JSON total {batch_data([product], [offers], [], [])['total']}")
+    print()
+
+async def test_autocomplete():
+    """Test product name autocomplete"""
+    print("=== Test: Autocomplete ===")
+    
+    result = await call_tool("autocomplete_products", {"prefix": "sam"})
+    print("Suggestions for 'sam':")
+    print(result[0].text)
+    print()
+
+async def test_output_formats():
+    """Test structured JSON output formats"""
+    print("=== Test: Output Formats ===")
+    
+    for output_format in ["markdown", "json", "compact"]:
+        result = await call_tool("search_products", {"query": "", "format": output_format})
+        print(f"Full catalog as {output_format}: {len(result[0].text.encode())} bytes")
+    
+    result = await call_tool("compare_prices", {"product_name": "iPhone 15 Pro Max", "format": "compact"})
+    offers = json.loads(result[0].text)["offers"]
+    print(f"Compact offer columns: {offers['columns']}")
+    print(f"Compact offer rows: {len(offers['rows'])}")
+    print()
+
+async def test_pagination():
+    """Test paging through search results with a size budget and cursors"""
+    print("=== Test: Pagination ===")
+    
+    arguments = {"query": "", "max_bytes": 1500}
+    pages = 0
+    products = 0
+    while True:
+        result = await call_tool("search_products", {**arguments, "format": "json"})
+        data = json.loads(result[0].text)
+        pages += 1
+        products += data["count"]
+        if "next_cursor" not in data:
+            break
+        arguments["cursor"] = data["next_cursor"]
+    print(f"Full catalog in pages of at most ~1500 bytes: {products} products in {pages} pages")
+    
+    result = await call_tool("search_products", {"query": "", "sort_by": "price", "page": 2, "page_size": 3})
+    print("Second page of 3, cheapest first:")
+    print(result[0].text)
+    print()
+
+async def test_store_adapters():
+    """Test concurrent store fan-out against a local stub HTTP server"""
+    print("=== Test: Store Adapters ===")
+    
+    stub, base_url = start_stub_store()
+    
+    adapters = shopping_mcp_server.STORE_ADAPTERS
+    saved = dict(adapters)
+    # Offers must come from the stub stores, not from an earlier run's disk cache
+    disk_cache, shopping_mcp_server.DISK_CACHE = shopping_mcp_server.DISK_CACHE, None
+    try:
+        adapters["noon"] = HttpStoreAdapter("noon", {"name": "Noon", "api_url": f"{base_url}/fast"})
+        adapters["amazon_ae"] = HttpStoreAdapter(
+            "amazon_ae", {"name": "Amazon AE", "api_url": f"{base_url}/slow", "timeout": 0.2}
+        )
+        adapters["sharaf_dg"] = HttpStoreAdapter("sharaf_dg", {"name": "Sharaf DG", "api_url": f"{base_url}/broken"})
+        shopping_mcp_server.RESULT_CACHE.clear()
+        
+        result = await call_tool("compare_prices", {"product_name": "Xbox Series X"})
+        print("Price comparison with a stub Noon backend, a slow Amazon AE and a malformed Sharaf DG:")
+        print(result[0].text)
+        print()
+        print(f"Partial comparison cached: {len(shopping_mcp_server.RESULT_CACHE.entries) > 0}")
+        print()
+        
+        # Trip the slow store's circuit breaker, then compare again
+        slow = ResilientStoreAdapter(adapters["amazon_ae"], CircuitBreaker(min_requests=2))
+        adapters["amazon_ae"] = slow
+        for product_name in ["Xbox Series S", "Nintendo Switch OLED", "LG 55 OLED TV"]:
+            start = time.perf_counter()
+            await call_tool("compare_prices", {"product_name": product_name})
+            print(f"Compare '{product_name}': {time.perf_counter() - start:.2f}s, "
+                  f"Amazon AE breaker {slow.breaker.state}")
+        print()
+    finally:
+        adapters.clear()
+        adapters.update(saved)
+        shopping_mcp_server.DISK_CACHE = disk_cache
+        shopping_mcp_server.RESULT_CACHE.clear()
+        stub.shutdown()
+
+class FlakyStoreAdapter(StoreAdapter):
+    """Store adapter that can be switched down, or made to hang until cancelled"""
+    
+    def __init__(self):
+        super().__init__("flaky", {"name": "Flaky"})
+        self.down = False
+        self.hang = False
+    
+    async def get_offer(self, product):
+        if self.hang:
+            await asyncio.sleep(3600)
+        if self.down:
+            raise ConnectionError("store is down")
+        return {"store": "Flaky", "price": 100.0, "currency": "AED", "in_stock": True}
+
+async def test_stale_offers():
+    """Test that known offers outlive a store outage up to the staleness bound"""
+    print("=== Test: Stale Offers ===")
+    
+    product = shopping_mcp_server.CATALOG.products[0]
+    flaky = FlakyStoreAdapter()
+    adapter = ResilientStoreAdapter(flaky, CircuitBreaker(min_requests=1), fresh_seconds=0, max_stale_seconds=0.2)
+    await adapter.get_offer(product)
+    
+    flaky.down = True
+    offer = await adapter.get_offer(product)
+    await asyncio.sleep(0)
+    print(f"Store down, known offer served: {offer['price']} {offer['currency']}, breaker {adapter.breaker.state}")
+    
+    await asyncio.sleep(0.3)
+    try:
+        await adapter.get_offer(product)
+        print("Offer older than the staleness bound: still served")
+    except Exception as e:
+        print(f"Offer older than the staleness bound: dropped ({type(e).__name__})")
+    
+    # A caller giving up is not a store failure
+    healthy = ResilientStoreAdapter(FlakyStoreAdapter(), CircuitBreaker(min_requests=1))
+    healthy.inner.hang = True
+    task = asyncio.ensure_future(healthy.get_offer(product))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    print(f"Cancelled request: breaker {healthy.breaker.state}, {healthy.breaker.outcomes.count(False)} failures")
+    await adapter.close()
+    print()
+
+async def test_runtime_store():
+    """Test that a store added at runtime takes part in price comparisons"""
+    print("=== Test: Runtime Store ===")
+    
+    stores = shopping_mcp_server.STORES
+    arguments = {"product_name": "iPhone 15 Pro Max", "include_out_of_stock": True}
+    await call_tool("compare_prices", arguments)
+    stores["dubai_store"] = {"name": "Dubai Store", "categories": ["electronics"]}
+    try:
+        result = await call_tool("compare_prices", arguments)
+        print(f"Store added at runtime listed: {'Dubai Store' in result[0].text}")
+    finally:
+        del stores["dubai_store"]
+        shopping_mcp_server.STORE_ADAPTERS.pop("dubai_store", None)
+    result = await call_tool("compare_prices", arguments)
+    print(f"Store listed after its removal: {'Dubai Store' in result[0].text}")
+    print()
+
+async def test_result_cache():
+    """Test result cache expiry, LRU eviction and invalidation on catalog reload"""
+    print("=== Test: Result Cache ===")
+    
+    cache = ResultCache(max_entries=2, ttl={"t": 0.05})
+    first, second, third = (cache.key("t", {"n": n}) for n in range(3))
+    cache.put(first, 1, "first")
+    cache.put(second, 1, "second")
+    cache.get(first, 1)
+    cache.put(third, 1, "third")
+    print(f"After a third entry: first={cache.get(first, 1)}, second={cache.get(second, 1)}, third={cache.get(third, 1)}")
+    print(f"Entry once the catalog version changes: {cache.get(third, 2)}")
+    cache.put(first, 1, "first")
+    time.sleep(0.06)
+    print(f"Entry after its TTL: {cache.get(first, 1)}")
+    print(f"Stats: {cache.stats()}")
+    
+    # Editing the products and reloading bumps the catalog version
+    product = shopping_mcp_server.MOCK_PRODUCTS["electronics"][0]
+    arguments = {"query": product["name"], "format": "json"}
+    price = product["price"]
+    before = json.loads((await call_tool("search_products", arguments))[0].text)
+    try:
+        product["price"] = price + 100
+        shopping_mcp_server.reload_catalog()
+        after = json.loads((await call_tool("search_products", arguments))[0].text)
+    finally:
+        product["price"] = price
+        shopping_mcp_server.reload_catalog()
+    print(f"Price of '{product['name']}' before and after a reload: "
+          f"{before['products'][0]['price']} -> {after['products'][0]['price']}")
+    print()
+
+async def test_request_coalescing():
+    """Test that identical concurrent calls share one computation"""
+    print("=== Test: Request Coalescing ===")
+    
+    shopping_mcp_server.RESULT_CACHE.clear()
+    before = shopping_mcp_server.IN_FLIGHT.coalesced
+    results = await asyncio.gather(*(
+        call_tool("search_products", {"query": "Samsung"}) for _ in range(10)
+    ))
+    print(f"10 concurrent identical searches: {shopping_mcp_server.IN_FLIGHT.coalesced - before} coalesced, "
+          f"{len({r[0].text for r in results})} distinct response(s)")
+    print()
+
+async def test_disk_cache():
+    """Test that the persistent cache survives reopening and respects versions"""
+    print("=== Test: Disk Cache ===")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite3")
+        key = ("search_products", '{"query":"Samsung"}')
+        
+        writer = DiskCache(path)
+        writer.put(key, "v1", ["cached response"])
+        writer.close()
+        
+        reader = DiskCache(path)
+        print(f"Same version after reopening: {reader.get(key, 'v1')[0]}")
+        print(f"Other version: {reader.get(key, 'v2')}")
+        
+        small = DiskCache(path, max_bytes=2000)
+        for i in range(200):
+            small.put(("search_products", str(i)), "v1", ["x" * 100])
+        small.evict()
+        print(f"Evicted {small.evictions} entries to stay under 2000 bytes")
+        small.close()
+        reader.close()
+        
+        # Async writes are queued while another process holds the write lock
+        cache = DiskCache(path)
+        blocker = sqlite3.connect(path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        start = time.perf_counter()
+        cache.put_nowait(("search_products", "queued"), "v1", ["queued response"])
+        queued = time.perf_counter() - start
+        await asyncio.sleep(0.2)
+        blocker.execute("COMMIT")
+        blocker.close()
+        stored = await cache.aget(("search_products", "queued"), "v1")
+        print(f"Write queued behind a locked database in {queued * 1000:.0f} ms, then read back: {stored[0]}")
+        await cache.aclose()
+    print()
+
+async def test_progress_notifications():
+    """Test that offers stream to the client as progress notifications"""
+    print("=== Test: Progress Notifications ===")
+    
+    from mcp.shared.memory import create_connected_server_and_client_session
+    
+    # Progress is only sent while a result is computed, not for cached ones
+    shopping_mcp_server.RESULT_CACHE.clear()
+    disk_cache, shopping_mcp_server.DISK_CACHE = shopping_mcp_server.DISK_CACHE, None
+    messages = []
+    
+    async def on_progress(progress, total, message):
+        messages.append(message)
+        print(f"Progress {progress:g}/{total if total is None else format(total, 'g')}: {message}")
+    
+    try:
+        async with create_connected_server_and_client_session(app) as client:
+            result = await client.call_tool("compare_prices", {"product_name": "Yeti", "include_out_of_stock": True},
+                                            progress_callback=on_progress)
+            await client.call_tool("search_products", {"query": "Samsung"}, progress_callback=on_progress)
+    finally:
+        shopping_mcp_server.DISK_CACHE = disk_cache
+    print(f"{len(messages)} progress notifications before the final responses ({len(result.content[0].text)} chars)")
+    print()
+
+async def test_http_transport():
+    """Test the streamable HTTP transport end to end"""
+    print("=== Test: HTTP Transport ===")
+    
+    import socket
+    import uvicorn
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+    
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(shopping_mcp_server.create_http_app(), port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+    
+    try:
+        async with streamablehttp_client(f"http://127.0.0.1:{port}/mcp") as (read_stream, write_stream, _):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                tools = await session.list_tools()
+                result = await session.call_tool("autocomplete_products", {"prefix": "sam", "format": "compact"})
+        print(f"Tools over HTTP: {[tool.name for tool in tools.tools]}")
+        print(f"autocomplete_products over HTTP: {result.content[0].text}")
+    finally:
+        server.should_exit = True
+        thread.join()
+    print()
+
+async def test_catalog_snapshot():
+    """Test that a catalog loaded from a snapshot answers like the original"""
+    print("=== Test: Catalog Snapshot ===")
+    
+    catalog = shopping_mcp_server.CATALOG
+    with tempfile.TemporaryDirectory() as directory:
+        catalog.save(directory)
+        loaded = Catalog.load(directory)
+        same = all(
+            loaded.search(query, sort_by=sort_by) == catalog.search(query, sort_by=sort_by)
+            for query in ["", "samsung", "pro", "samsng"]
+            for sort_by in [None, "price", "rating", "relevance"]
+        )
+        print(f"Same search results after loading: {same}")
+        print(f"Memory-mapped price column is read-only: {not loaded.price.flags.writeable}")
+        shared = [loaded.index.postings.values, loaded.spelling.deletes.values, loaded.ranking.doc_weights,
+                  loaded.name_trie.top, loaded.names]
+        print(f"Memory-mapped text indexes are read-only: {not any(array.flags.writeable for array in shared)}")
+        print(f"Completions for 'sam': {[loaded.products[i].name for i in loaded.complete('sam')]}")
+        print(f"Corrections and name lookups after loading: {loaded.correct('samsng galxy')}, "
+              f"{loaded.resolve_name('PlayStation 5').name}")
+        sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))}
+        print(f"Snapshot files: {sizes}")
+    print()
+
 async def test_store_info():
     """Test store information functionality"""
     print("=== Test: Store Information ===")
@@ -91,6 +496,19 @@ async def main():
     
     await test_search_products()
     await test_compare_prices()
+    await test_compare_prices_batch()
+    await test_autocomplete()
+    await test_output_formats()
+    await test_pagination()
+    await test_store_adapters()
+    await test_stale_offers()
+    await test_runtime_store()
+    await test_result_cache()
+    await test_request_coalescing()
+    await test_disk_cache()
+    await test_progress_notifications()
+    await test_http_transport()
+    await test_catalog_snapshot()
     await test_store_info()
     
     print("All tests completed!")